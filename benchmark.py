@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+
+import sys, argparse, contextlib, json, os, platform, random, subprocess, tempfile, time, tracemalloc
+from collections import Counter
+
+from namegen import PartitionGroup, METHOD_MAPPING
+from namegen_syllable import AdaptedCorpus, Transcriber, ImpossibleFilter, SoundManager, CORPUS_CACHE
+from namegen_utils import *
+
+# -------------------------------------------------------------------------------------------------
+# Synthetic corpora
+# -------------------------------------------------------------------------------------------------
+
+ONSETS = ['', 'b', 'br', 'd', 'dr', 'f', 'g', 'gr', 'k', 'kr', 'l', 'm', 'n', 'p', 'r', 's', 'st', 't', 'th', 'v', 'z']
+CODAS  = ['', 'n', 'r', 'l', 's', 'th', 'nd']
+VOWELS = [('a', 'AH'), ('e', 'EH'), ('i', 'IY'), ('o', 'OW'), ('u', 'UW'), ('ae', 'EY'), ('y', 'AY')]
+
+def SyntheticSyllables(rng, count):
+	'''Returns `count` distinct (spelling, sound) syllables, with the sound written like a CMU phoneme.'''
+
+	inventory = [(o + v + c, o.upper() + s + c.upper()) for o in ONSETS for v, s in VOWELS for c in CODAS]
+	return rng.sample(inventory, min(count, len(inventory)))
+
+
+def SyntheticWords(rng, syllables, count, minSyllables=2, maxSyllables=4):
+	'''
+	Yields `count` (spelling, sounds) words built from `syllables`.  Syllables are picked with Zipf-like weights so
+	some are much more common than others, like in real names.
+	'''
+
+	weights = [1 / (rank + 1) for rank in range(len(syllables))]
+
+	for _ in range(count):
+		picked = rng.choices(syllables, weights, k=rng.randint(minSyllables, maxSyllables))
+		yield ''.join(x for x, _ in picked), [x for _, x in picked]
+
+
+def WriteCorpora(directory, rng, names, words, syllables):
+
+	'''
+	Write a plain list of names, the same names annotated with their syllables, and a CMU-like pronouncing
+	dictionary (so the benchmarks never need NLTK) into `directory`.  Returns the three file names, along with
+	the syllables of each name.
+	'''
+
+	inventory = SyntheticSyllables(rng, syllables)
+	entries   = list(SyntheticWords(rng, inventory, names))
+
+	plain, annotated, cmu = (os.path.join(directory, x) for x in ('names.txt', 'syllables.txt', 'cmudict.txt'))
+
+	with open(plain, 'w') as f:
+		f.writelines(f'{name.capitalize()}\n' for name, _ in entries)
+
+	with open(annotated, 'w') as f:
+		f.writelines('{}\n\t{}\n'.format(name.capitalize(), ' '.join(sounds)) for name, sounds in entries)
+
+	with open(cmu, 'w') as f:
+		f.write(';;; Synthetic pronouncing dictionary\n')
+		for word, sounds in SyntheticWords(rng, inventory, words, 1, 3):
+			stressed = [x + ('1' if i == 0 else '0') for i, x in enumerate(sounds)]
+			f.write('{}  {}\n'.format(word.upper(), ' '.join(stressed)))
+
+	return plain, annotated, cmu, [sounds for _, sounds in entries]
+
+
+# -------------------------------------------------------------------------------------------------
+# Benchmarks.  Each returns a dictionary of results, and is run again under tracemalloc for its peak memory.
+# -------------------------------------------------------------------------------------------------
+
+def Best(func, repeat):
+	'''Returns the fastest of `repeat` runs of `func`, in seconds.'''
+
+	timings = []
+	for _ in range(max(1, repeat)):
+		began = time.perf_counter()
+		func()
+		timings.append(time.perf_counter() - began)
+
+	return min(timings)
+
+
+def Percentiles(latencies):
+	'''Summarize latencies (in seconds) as milliseconds.'''
+
+	latencies = sorted(latencies)
+	pick      = lambda p: round(1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4)
+
+	return {
+		'mean_ms' : round(1000 * sum(latencies) / len(latencies), 4),
+		'p50_ms'  : pick(0.50),
+		'p95_ms'  : pick(0.95),
+		'max_ms'  : pick(1.0),
+	}
+
+
+def BenchPartition(names, args):
+	'''PartitionGroup throughput for every METHOD_MAPPING entry.'''
+
+	results = {}
+
+	for method, func in sorted(METHOD_MAPPING.items()):
+		rng     = random.Random(args.seed)
+		seconds = Best(lambda: sum(1 for _ in PartitionGroup(names, func, 'around', rng)), args.repeat)
+		results[method] = { 'seconds' : round(seconds, 4), 'names_per_second' : round(len(names) / seconds, 1) }
+
+	return results
+
+
+def BenchTraining(entries, args):
+	'''MarkovChainHandler.UpdateTermString training rate.'''
+
+	def Train():
+		chain = MarkovChainHandler(args)
+		for entry in entries:
+			chain.UpdateTermString(entry)
+
+	seconds = Best(Train, args.repeat)
+	terms   = sum(len(x) for x in entries)
+
+	return {
+		'seconds'          : round(seconds, 4),
+		'names_per_second' : round(len(entries) / seconds, 1),
+		'terms_per_second' : round(terms / seconds, 1),
+	}
+
+
+def BenchGeneration(entries, names, args):
+	'''GenerateChain throughput, and how many generations are rejected, already known or repeated.'''
+
+	chain = MarkovChainHandler(args)
+	for entry in entries:
+		chain.UpdateTermString(entry)
+
+	chain.Prepare()
+
+	known    = { x.capitalize() for x in names }
+	verdicts = Counter()
+	rng      = random.Random(args.seed)
+
+	began = time.perf_counter()
+	generated = [chain.GenerateChain(rng) for _ in range(args.samples)]
+	seconds   = time.perf_counter() - began
+
+	produced = set()
+	for result in generated:
+
+		if not result:
+			verdicts['rejected'] += 1
+			continue
+
+		name = ''.join(result).capitalize()
+
+		if name in known:
+			verdicts['in_training'] += 1
+		elif name in produced:
+			verdicts['duplicate'] += 1
+		else:
+			verdicts['novel'] += 1
+			produced.add(name)
+
+	return {
+		'seconds'               : round(seconds, 4),
+		'names_per_second'      : round(args.samples / seconds, 1),
+		'novel_per_second'      : round(verdicts['novel'] / seconds, 1),
+		'rejection_rate'        : round(verdicts['rejected'] / args.samples, 4),
+		'in_training_rate'      : round(verdicts['in_training'] / args.samples, 4),
+		'duplicate_rate'        : round(verdicts['duplicate'] / args.samples, 4),
+	}
+
+
+def BenchCorpusLoad(files, cmu, args):
+	'''AdaptedCorpus load time, both from scratch and once cached.'''
+
+	CORPUS_CACHE.Clear()
+
+	with contextlib.redirect_stdout(sys.stderr):
+		began = time.perf_counter()
+		AdaptedCorpus(files, cmu)
+		cold  = time.perf_counter() - began
+
+		warm = Best(lambda: AdaptedCorpus(files, cmu), args.repeat)
+
+	return { 'cold_seconds' : round(cold, 4), 'cached_seconds' : round(warm, 6) }
+
+
+def BenchTranscription(transcriber, impossible, syllables, args):
+	'''SoundManager latency (transcribing one name's syllables into spellings).'''
+
+	latencies = []
+	spellings = 0
+
+	for each in syllables:
+		began   = time.perf_counter()
+		manager = SoundManager(each, transcriber, impossible)
+		latencies.append(time.perf_counter() - began)
+		spellings += sum(len(x) for x in manager._history._history)
+
+	return dict(Percentiles(latencies), names=len(syllables), spellings_per_name=round(spellings / len(syllables), 2))
+
+
+def BenchStartup(args):
+	'''Time to start a fresh interpreter and import each script.'''
+
+	results = {}
+	here    = os.path.dirname(os.path.abspath(__file__))
+
+	for module in ('namegen', 'namegen_syllable'):
+		command = [sys.executable, '-c', f'import {module}']
+		seconds = Best(lambda: subprocess.run(command, cwd=here, check=True), args.repeat)
+		results[module] = { 'seconds' : round(seconds, 4) }
+
+	return results
+
+
+def Measure(func, *fargs, memory=True):
+	'''Run a benchmark, then (if asked) run it again under tracemalloc to find its peak memory use.'''
+
+	result = func(*fargs)
+
+	if memory:
+		tracemalloc.start()
+		func(*fargs)
+		result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+	return result
+
+
+def Compare(results, baseline, prefix=''):
+	'''Print the relative change of every number in `results` from the same number in `baseline`.'''
+
+	for key, value in results.items():
+
+		name = prefix + key
+		if isinstance(value, dict) and isinstance(baseline.get(key), dict):
+			Compare(value, baseline[key], name + '.')
+
+		elif isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+			print('{:<48} {:>14} => {:<14} {:+.1f}%'.format(name, baseline[key], value, 100 * (value - baseline[key]) / baseline[key]))
+
+
+# -------------------------------------------------------------------------------------------------
+# Drive the program fooooooorward into the future!
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+	ap = argparse.ArgumentParser('Benchmarks training, sampling, transcription and startup on synthetic corpora')
+
+	ap.add_argument('--names', type=int, default=20000, help='Number of names in the synthetic corpus.')
+	ap.add_argument('--words', type=int, default=20000, help='Number of words in the synthetic pronouncing dictionary.')
+	ap.add_argument('--syllables', type=int, default=300, help='Number of distinct syllables names and words are built from.')
+	ap.add_argument('--samples', type=int, default=20000, help='Number of names generated when measuring sampling.')
+	ap.add_argument('--transcriptions', type=int, default=200, help='Number of names transcribed when measuring transcription.')
+	ap.add_argument('--repeat', type=int, default=3, help='Time each throughput benchmark this many times, keeping the fastest.')
+	ap.add_argument('--seed', type=int, default=0, help='Seed for the synthetic corpora and every random choice made.')
+
+	ap.add_argument('--only', nargs='+',
+		choices = ('partition', 'training', 'generation', 'corpus_load', 'transcription', 'startup'),
+		help    = 'Only run these benchmarks.')
+
+	ap.add_argument('--no-memory', action='store_true', help='Skip measuring peak memory (which runs every benchmark twice).')
+	ap.add_argument('-o', '--output', help='Write the JSON results here instead of stdout.')
+	ap.add_argument('--compare', metavar='BASELINE', help='Also print how the results changed from an earlier JSON result file.')
+
+	ap.add_argument('--minlen', type=int, default=4,  help='Minimum string length of generated names.')
+	ap.add_argument('--maxlen', type=int, default=13, help='Force markov chain termination if the name is at least this size.')
+
+	args = ap.parse_args()
+
+	args.direction = 'forward'
+	args.start     = None
+
+	only   = set(args.only or ('partition', 'training', 'generation', 'corpus_load', 'transcription', 'startup'))
+	memory = not args.no_memory
+	rng    = random.Random(args.seed)
+
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+			cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		commit = None
+
+	report = {
+		'commit'     : commit,
+		'python'     : platform.python_version(),
+		'platform'   : platform.platform(),
+		'parameters' : { k : getattr(args, k) for k in ('names', 'words', 'syllables', 'samples', 'transcriptions', 'repeat', 'seed') },
+		'results'    : {},
+	}
+
+	results = report['results']
+
+	with tempfile.TemporaryDirectory() as directory:
+
+		plain, annotated, cmu, sounds = WriteCorpora(directory, rng, args.names, args.words, args.syllables)
+
+		names   = [FilterWord(x, LETTERS_AND_SPACES) for x in YieldNames([plain])]
+		entries = [x for x in PartitionGroup(names, METHOD_MAPPING['letters'], 'around') if x]
+
+		if 'partition' in only:
+			results['partition'] = Measure(BenchPartition, names, args, memory=memory)
+
+		if 'training' in only:
+			results['training'] = Measure(BenchTraining, entries, args, memory=memory)
+
+		if 'generation' in only:
+			results['generation'] = Measure(BenchGeneration, entries, names, args, memory=memory)
+
+		if 'corpus_load' in only:
+			results['corpus_load'] = Measure(BenchCorpusLoad, [annotated], cmu, args, memory=memory)
+
+		if 'transcription' in only:
+
+			with contextlib.redirect_stdout(sys.stderr):
+				transcriber = Transcriber([annotated], cmu)
+				impossible  = ImpossibleFilter([annotated], cmu)
+
+			# Transcribe new combinations of the corpus' syllables, like the syllable generator would.
+			inventory = sorted({ x for each in sounds for x in each })
+			syllables = [rng.sample(inventory, rng.randint(2, 3)) for _ in range(args.transcriptions)]
+
+			results['transcription'] = Measure(BenchTranscription, transcriber, impossible, syllables, args, memory=memory)
+
+		if 'startup' in only:
+			results['startup'] = BenchStartup(args)
+
+	text = json.dumps(report, indent='\t') + '\n'
+
+	if args.output:
+		AtomicWrite(args.output, text)
+	else:
+		sys.stdout.write(text)
+
+	if args.compare:
+		with open(args.compare, 'r') as f:
+			Compare(results, json.load(f)['results'])
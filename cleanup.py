@@ -1,25 +1,82 @@
-import os
-from namegen_utils import ObtainSyllables
+import os, argparse, hashlib, json
+from concurrent.futures import ProcessPoolExecutor
+from namegen_utils import ObtainSyllables, AtomicWrite
 
 
+def ContentHash(fname):
+	'''Returns a hash of a file's contents.'''
+	with open(fname, 'rb') as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
 
 def Cleanup(fname):
-	
+
+	'''
+	Sorts and normalizes a file of names and syllables, returning the hash of the normalized file.
+	The file is only rewritten (atomically) if normalizing actually changed it.
+	'''
+
 	names_and_syls = { k.capitalize() : v for k, v in ObtainSyllables([fname], True).items() }
-	
-	with open(fname, 'w') as f:
-		for name in sorted(names_and_syls):
-			f.write(f'{name}\n')
-			for syllables in sorted(names_and_syls[name]):
-				f.write('\t{}\n'.format(' '.join(syllables)))
+
+	lines = []
+	for name in sorted(names_and_syls):
+		lines.append(f'{name}\n')
+		for syllables in sorted(names_and_syls[name]):
+			lines.append('\t{}\n'.format(' '.join(syllables)))
+
+	normalized = ''.join(lines)
+
+	with open(fname, 'r') as f:
+		if f.read() != normalized:
+			AtomicWrite(fname, normalized)
+
+	return ContentHash(fname)
+
+
+def LoadManifest(fname):
+	'''Returns the hash of every file recorded as already normalized.'''
+
+	if not os.path.exists(fname):
+		return {}
+
+	with open(fname, 'r') as f:
+		return json.load(f)
 
 
 if __name__ == '__main__':
 
-	for eachdir in ['resource', 'generated']:
+	ap = argparse.ArgumentParser('Sorts and normalizes files of names and syllables')
+
+	ap.add_argument('directories', nargs='*', default=['resource', 'generated'],
+		help='Directories whose files are normalized.')
+
+	ap.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+		help='Number of processes normalizing files at once.')
+
+	ap.add_argument('--manifest', default='.cleanup_manifest.json',
+		help='File recording the hashes of already normalized files, so unchanged files are skipped on the next run.')
+
+	ap.add_argument('--force', action='store_true',
+		help='Normalize every file, even ones the manifest says are unchanged.')
+
+	args = ap.parse_args()
+
+	manifest = {} if args.force else LoadManifest(args.manifest)
+
+	content = []
+	for eachdir in args.directories:
 		if os.path.exists(eachdir):
-			content = [os.path.join(eachdir, x) for x in os.listdir(eachdir)]
-			content = [x for x in content if not os.path.isdir(x)]
-			for eachfile in content:
-				Cleanup(eachfile)
-	
\ No newline at end of file
+			content.extend(os.path.join(eachdir, x) for x in sorted(os.listdir(eachdir)))
+
+	content = [x for x in content if not os.path.isdir(x)]
+	stale   = [x for x in content if manifest.get(x) != ContentHash(x)]
+
+	with ProcessPoolExecutor(max(1, args.jobs)) as pool:
+		for eachfile, digest in zip(stale, pool.map(Cleanup, stale)):
+			manifest[eachfile] = digest
+
+	# Forget files that no longer exist so the manifest doesn't grow forever.
+	manifest = { k : v for k, v in manifest.items() if os.path.exists(k) }
+	AtomicWrite(args.manifest, json.dumps(manifest, indent='\t', sort_keys=True) + '\n')
+
+	print(f'Normalized {len(stale)} of {len(content)} files.')
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import functools, itertools, os
+
 from collections   import defaultdict
 from namegen_utils import *
 from nltk.corpus   import cmudict
@@ -23,32 +25,174 @@ def Chunk(l, s):
 	for i in range(0, len(l), s):
 		yield l[i:i+s]
 	
-def ListPermuter(what):
-	
-	if what:
-	
-		me = what[0]
-									
-		if type(me) is list:
-			tmp = []
-			for element in me:
-				tmp.append([RemoveNumbers(x) for x in element])
-			
-			for element in tmp:
-				if len(what) == 1:
-					yield element
-				else:
-					for result in ListPermuter(what[1:]):
-						yield element + result
-	
+# The most pronunciations "add @@word word word" will produce for a single entry.
+MAX_PERMUTATIONS = 256
+
+@functools.lru_cache(maxsize=None)
+def StrippedPronunciations(word):
+	'''Returns the pronunciations of a word in WORDS with stress numbers removed, computed once per word.'''
+	return tuple(dict.fromkeys(tuple(RemoveNumbers(x) for x in variant) for variant in WORDS[word]))
+
+def ListPermuter(what, limit=MAX_PERMUTATIONS):
+
+	'''
+	Lazily yields each distinct way of combining the pronunciations in `what`, stopping after `limit` of them
+	(or never, if `limit` is None).
+
+	Each element of `what` is either a literal sound, a list of raw pronunciations (whose stress numbers are
+	removed here, once), or a tuple of pronunciations that were already stripped (see StrippedPronunciations).
+	'''
+
+	if not what:
+		return
+
+	options = []
+	for me in what:
+
+		if type(me) is tuple:
+			options.append(me)
+
+		elif type(me) is list:
+			options.append(tuple(dict.fromkeys(tuple(RemoveNumbers(x) for x in element) for element in me)))
+
 		else:
-			tmp = [RemoveNumbers(me)]
-			if len(what) == 1:
-				yield tmp
-			else:
-				for result in ListPermuter(what[1:]):
-					yield tmp + result
+			options.append(((RemoveNumbers(me),),))
+
+	seen = set()
+	for combination in itertools.product(*options):
+
+		flattened = tuple(itertools.chain.from_iterable(combination))
+		if flattened in seen:
+			continue
+
+		seen.add(flattened)
+		yield list(flattened)
+
+		if limit is not None and len(seen) >= limit:
+			return
 		
+class PhonemeIndex(object):
+
+	'''
+	Reverse lookup from sounds to the words that make them, along with a fast way of breaking
+	unknown names into known words.
+
+	Every contiguous run of up to `maxlen` phonemes (stress numbers removed) in every pronunciation
+	maps to the words containing it.  Longer runs are found by intersecting the words for each
+	`maxlen` window of the run and then checking those candidates directly.
+	'''
+
+	def __init__(self, words, maxlen=3):
+
+		self._maxlen   = maxlen
+		self._stripped = {}
+		self._index    = defaultdict(set)
+		self._longest  = max(len(x) for x in words)
+
+		for word, variants in words.items():
+
+			stripped = tuple(dict.fromkeys(tuple(RemoveNumbers(x) for x in variant) for variant in variants))
+			self._stripped[word] = stripped
+
+			for sounds in stripped:
+				for i in range(len(sounds)):
+					for j in range(i+1, min(len(sounds), i+maxlen)+1):
+						self._index[sounds[i:j]].add(word)
+
+	@staticmethod
+	def _Contains(sounds, run):
+		'''Returns if `run` appears contiguously in `sounds`.'''
+		return any(sounds[i:i+len(run)] == run for i in range(len(sounds) - len(run) + 1))
+
+	def WordsWithSounds(self, sounds, exact=False):
+
+		'''
+		Returns the words whose pronunciation contains the run of phonemes `sounds` (or matches it completely
+		if `exact` is set).  Stress numbers and case in `sounds` are ignored.
+		'''
+
+		run = tuple(RemoveNumbers(x).upper() for x in sounds)
+		if not run:
+			return set()
+
+		windows    = [run[i:i+self._maxlen] for i in range(max(1, len(run) - self._maxlen + 1))]
+		candidates = set.intersection(*(self._index.get(x, set()) for x in windows))
+
+		if exact:
+			return {x for x in candidates if run in self._stripped[x]}
+
+		if len(run) > self._maxlen:
+			return {x for x in candidates if any(self._Contains(y, run) for y in self._stripped[x])}
+
+		return candidates
+
+	def Segment(self, name, minPiece=2):
+
+		'''
+		Yields ways of spelling `name` as a run of dictionary words of at least `minPiece` letters, trying the
+		longest matching word first at each position so the most natural segmentations come out first.
+		'''
+
+		name = name.lower()
+		dead = set()
+
+		def Segmentations(start):
+
+			if start == len(name):
+				yield []
+				return
+
+			found = False
+			for end in range(min(len(name), start + self._longest), start + minPiece - 1, -1):
+
+				piece = name[start:end]
+				if end in dead or piece not in self._stripped:
+					continue
+
+				for rest in Segmentations(end):
+					found = True
+					yield [piece] + rest
+
+			# Remember positions the rest of the name can't be spelled from so they're never retried.
+			if not found:
+				dead.add(start)
+
+		yield from Segmentations(0)
+
+	def Suggest(self, name, limit=8):
+
+		'''Propose up to `limit` syllabifications of `name` by combining the pronunciations of the words it segments into.'''
+
+		suggestions = []
+
+		for pieces in self.Segment(name):
+			for syllables in ListPermuter([self._stripped[piece] for piece in pieces], limit):
+
+				syllables = tuple(syllables)
+				if syllables not in suggestions:
+					suggestions.append(syllables)
+
+				if len(suggestions) >= limit:
+					return suggestions
+
+		return suggestions
+
+
+_PHONEME_INDEX = None
+
+def GetPhonemeIndex():
+	'''Returns the PhonemeIndex over WORDS, building it the first time it's needed.'''
+
+	global _PHONEME_INDEX
+
+	if _PHONEME_INDEX is None:
+		print('Building phoneme index.  This may take a while...', end=' ')
+		_PHONEME_INDEX = PhonemeIndex(WORDS)
+		print('done!')
+
+	return _PHONEME_INDEX
+
+
 def UpdateSyllablesFor(term, data):
 
 	syllable_groups = list(data[term])
@@ -65,6 +209,7 @@ def UpdateSyllablesFor(term, data):
 			print('')
 			
 		print('\tEnter "try <words> <or> <syllables>" to find pronunciation.')
+		print('\tEnter "sounds <SOUNDS>" to find words containing a run of sounds.')
 		print('\tEnter "add <sounds> <to> <add>" to append a sound to this name.')
 		print('\t\t - Start with an "@" to grab syllables from a word.')
 		print('\t\t - Start with "@@" to grab syllables from all following words.')
@@ -90,6 +235,18 @@ def UpdateSyllablesFor(term, data):
 					for variant in WORDS[word]:
 						print('\t',variant)
 						
+		# Find words by how they sound rather than how they're spelled ---------
+		elif result.startswith('sounds '):
+		
+			sounds = result[len('sounds '):].split()
+			
+			exact = GetPhonemeIndex().WordsWithSounds(sounds, exact=True)
+			found = GetPhonemeIndex().WordsWithSounds(sounds)
+			
+			print(f'Sounds {sounds}:')
+			print('\tExactly :', ' '.join(sorted(exact)[:20]) or 'Not found...')
+			print('\tContains:', ' '.join(sorted(found, key=len)[:20]) or 'Not found...')
+			
 		# Add syllabification for the current term ----------------------------
 		elif result.startswith('add '):	
 		
@@ -97,7 +254,7 @@ def UpdateSyllablesFor(term, data):
 		
 			def AmpersandReplace(what):
 				if what in WORDS:
-					return WORDS[what]
+					return StrippedPronunciations(what)
 				else:
 					print(what, 'not recognized...ignoring input.')
 					return None
@@ -117,7 +274,13 @@ def UpdateSyllablesFor(term, data):
 				else:
 					final.append(entry)
 
-			syllable_groups += [x for x in ListPermuter(final)]
+			# Ask for one extra so we only warn when something was actually left out.
+			permutations = list(ListPermuter(final, MAX_PERMUTATIONS + 1))
+			if len(permutations) > MAX_PERMUTATIONS:
+				permutations = permutations[:MAX_PERMUTATIONS]
+				print(f'Only kept the first {MAX_PERMUTATIONS} pronunciations...')
+				
+			syllable_groups += permutations
 		
 		# Move to the next term -------------------------------------------
 		elif result.startswith('next'):
@@ -132,10 +295,16 @@ def UpdateSyllablesFor(term, data):
 				print(f'Index {num} does not exist...')
 				
 				
+	before     = data[term]
 	data[term] = set(tuple(x) for x in syllable_groups)
+	
+	# Report what changed so it can be journaled rather than rewriting the whole file.
+	return [('-', term, x) for x in before - data[term]] + [('+', term, x) for x in data[term] - before]
+
 
+def SaveToFile(data, fname, keepEmpty=False):
 
-def SaveToFile(data, fname):
+	''' Write `data` as a syllable file.  Terms without syllables are left out (so they can be deleted) unless `keepEmpty` is set. '''
 
 	if fname is None:
 		fname = input('Save to what file? => ').strip()
@@ -145,28 +314,174 @@ def SaveToFile(data, fname):
 	for term, entries in sorted(data.items()):
 	
 		# Only append things that have entries so we can delete terms too!
-		if entries:
+		if entries or keepEmpty:
 			final_strings.append(term + '\n')
 			for entry in set(entries):
 				stringify = RemoveNumbers(' '.join(entry))
 				final_strings.append(f'\t{stringify}\n')
 			
-	with open(fname, 'w') as f:
-		for elem in final_strings:
-			f.write(elem)
+	AtomicWrite(fname, ''.join(final_strings))
 	
+	
+class EditJournal(object):
+
+	'''
+	Makes saving proportional to the size of an edit rather than the size of the file.
+
+	Edits are appended to a journal next to the saved file ("<file>.journal") as lines of
+	"+<tab>Name<tab>SYL SYL" (syllables added) or "-<tab>Name<tab>SYL SYL" (syllables removed),
+	and replayed whenever the file is loaded.  Compacting folds the journal back into the sorted
+	file.  Replaying is idempotent, so a crash while compacting (between rewriting the file and
+	deleting its journal) or a partially written journal line never loses or corrupts saved edits.
+	'''
+
+	def __init__(self):
+
+		# The file whose contents (with its journal replayed) match the loaded data, less any pending edits.
+		self._fname   = None
+		self._pending = []
+
+	@staticmethod
+	def PathFor(fname):
+		'''Returns where the journal for a file is kept.'''
+		return fname + '.journal'
+
+	@staticmethod
+	def Replay(data, fname):
+
+		'''Applies the journal for `fname` to `data`, returning how many edits were replayed.'''
+
+		path = EditJournal.PathFor(fname)
+		if not os.path.exists(path):
+			return 0
+
+		replayed = 0
+		with open(path, 'r') as f:
+			for line in f:
+
+				fields = line.rstrip('\n').split('\t')
+				if len(fields) != 3 or fields[0] not in '+-' or not line.endswith('\n'):
+					continue
+
+				op, term, syllables = fields
+				syllables = tuple(syllables.split(' '))
+
+				if op == '+':
+					data[term].add(syllables)
+				else:
+					data[term].discard(syllables)
+
+				replayed += 1
+
+		return replayed
+
+	@staticmethod
+	def Compact(fname):
+
+		'''Folds the journal for `fname` into the sorted file itself, then removes the journal.'''
+
+		path = EditJournal.PathFor(fname)
+		if not os.path.exists(path):
+			return
+
+		words = defaultdict(set)
+		for word, syls in ObtainSyllables([fname], True).items():
+			words[word.capitalize()] |= syls
+
+		EditJournal.Replay(words, fname)
+		SaveToFile(words, fname)
+		os.remove(path)
+
+	def Loaded(self, fname, merged):
+		'''Note that `fname` was loaded.  Only a file loaded on its own (with nothing else edited) can be journaled against.'''
+		self._fname = None if merged or self._pending else fname
+
+	def Record(self, edits):
+		'''Remember edits made to the loaded data until they're saved.'''
+		self._pending.extend(edits)
+
+	def Save(self, data, fname):
+
+		'''Append the pending edits to the journal of `fname` if possible, otherwise write out the whole file.'''
+
+		if fname is None:
+			fname = input('Save to what file? => ').strip()
+
+		if fname == self._fname and os.path.exists(fname):
+
+			with open(self.PathFor(fname), 'a') as f:
+				for op, term, syllables in self._pending:
+					stringify = RemoveNumbers(' '.join(syllables))
+					f.write(f'{op}\t{term}\t{stringify}\n')
+
+				f.flush()
+				os.fsync(f.fileno())
+
+		else:
+			# The journal describes edits to the file being replaced, so it goes first.
+			if os.path.exists(self.PathFor(fname)):
+				os.remove(self.PathFor(fname))
+
+			SaveToFile(data, fname)
+			self._fname = fname
+
+		self._pending = []
+
+	def Close(self):
+		'''Compact the journal of the file being edited, if there is one.  Unsaved edits are discarded.'''
+
+		if self._fname is not None:
+			self.Compact(self._fname)
+
 			
-def LoadAndMergeData(data, fname):
+def LoadAndMergeData(data, fname, journal=None):
 
 	if fname is None:
 		fname = input('Load what file? => ').strip()
 				
-	words = ObtainSyllables([fname], True)	
+	merged = bool(data)
+	words  = ObtainSyllables([fname], True)	
 	
 	for word, syls in words.items():
 		data[word.capitalize()] |= syls
+		
+	replayed = EditJournal.Replay(data, fname)
+	
+	if journal is not None:
+		journal.Loaded(fname, merged)
 				
 	print('Loaded', len(words), 'names')
+	
+	if replayed:
+		print('Replayed', replayed, 'journaled edits')
+	
+	
+def CorpifyFile(fname, outname):
+
+	'''
+	Propose syllabifications for every name in `fname` that doesn't have any, writing the file's
+	names along with the proposals to `outname` so they can be reviewed (and loaded) later.
+	'''
+
+	if fname is None:
+		fname = input('Corpify what file? => ').strip()
+		
+	if outname is None:
+		outname = input('Save proposals to what file? => ').strip()
+		
+	words = ObtainSyllables([fname], True)
+	index = GetPhonemeIndex()
+	
+	proposed = 0
+	missing  = [word for word, syls in words.items() if not syls]
+	
+	for word in missing:
+		words[word] |= set(index.Suggest(word))
+		proposed += bool(words[word])
+		
+	SaveToFile({ word.capitalize() : syls for word, syls in words.items() }, outname, keepEmpty=True)
+	
+	print(f'Proposed syllables for {proposed} of {len(missing)} names without any')
 				
 def ShowLoadedWords(data):
 
@@ -183,7 +498,8 @@ def ShowLoadedWords(data):
 		
 if __name__ == '__main__':
 
-	data = defaultdict(set)
+	data    = defaultdict(set)
+	journal = EditJournal()
 
 	while 1:
 
@@ -192,8 +508,9 @@ if __name__ == '__main__':
 		print('\tEdit/Add) Propose a new word or modify an existing word.')
 		print('\t          Append a word to automatically modify it without needing to enter a separate word.')
 		print('\tShow)     Show all loaded words')
+		print('\tCorpify)  Propose syllables for every name in a file without any, saving them to another file.')
 		print('\tSave)     Save to file.')
-		print('\tExit)     Exit without saving.')
+		print('\tExit)     Exit without saving (saved edits are compacted into their file).')
 		
 		choice = input(' => ').strip().lower()
 		
@@ -203,7 +520,7 @@ if __name__ == '__main__':
 		if choice:
 		
 			if choice.startswith('load'):
-				LoadAndMergeData(data, args[0] if args else None)
+				LoadAndMergeData(data, args[0] if args else None, journal)
 				
 			elif choice.startswith('edit') or choice.startswith('add'):
 			
@@ -211,13 +528,17 @@ if __name__ == '__main__':
 				entry = entry.capitalize()
 				
 				if entry:
-					UpdateSyllablesFor(entry, data)
+					journal.Record(UpdateSyllablesFor(entry, data))
 					
 			elif choice.startswith('show'):
 				ShowLoadedWords(data)
 				
+			elif choice.startswith('corpify'):
+				CorpifyFile(args[0] if args else None, args[1] if len(args) > 1 else None)
+				
 			elif choice.startswith('save'):
-				SaveToFile(data, args[0] if args else None)
+				journal.Save(data, args[0] if args else None)
 				
 			elif choice.startswith('exit'):
+				journal.Close()
 				break
\ No newline at end of file
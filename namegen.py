@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 
-import sys, random, argparse, os
+import sys, random, argparse, os, pickle, hashlib, time, signal, functools, atexit
+from itertools import repeat, islice
+from concurrent.futures import ProcessPoolExecutor
 
 from namegen_utils import *
 
 # -------------------------------------------------------------------------------------------------
 # Split entries by rule
 # -------------------------------------------------------------------------------------------------
-def PartitionGroup(entries, whatfunc, position):
+def PartitionGroup(entries, whatfunc, position, rng=random):
 
 	'''
 
@@ -31,41 +33,55 @@ def PartitionGroup(entries, whatfunc, position):
 			4) `position`=='random' : Nondeterministic.  Randomly picks 'before'/'after'/'around' after each
 			    successful match or iteration performed.
 
+	Random choices (including those made by `choose_randomly`) are made with `rng`.
+
 	'''
 
-	original_position = position
+	if whatfunc is choose_randomly:
+		whatfunc = functools.partial(choose_randomly, rng=rng)
 
 	for word in entries:
+		yield PartitionWord(word, whatfunc, position, rng)
+
+
+def PartitionWord(word, whatfunc, position, rng=random):
+
+	'''
+	Split a single word apart, as PartitionGroup does for each of its entries.  Unlike PartitionGroup, a
+	`whatfunc` of `choose_randomly` isn't given `rng`, so bind it first if that matters.
+	'''
 
-		letterlist  = list(word)
-		nonmatching = ['']
+	original_position = position
 
-		while letterlist:
+	letterlist  = list(word)
+	nonmatching = ['']
 
-			if original_position == 'random':
-				position = random.choice(('before', 'after', 'around'))
+	while letterlist:
 
-			match, consume = whatfunc(letterlist)
+		if original_position == 'random':
+			position = rng.choice(('before', 'after', 'around'))
 
-			if match:
+		match, consume = whatfunc(letterlist)
 
-				consumed   = ''.join(letterlist[:consume])
-				letterlist = letterlist[consume:]
+		if match:
 
-				if position == 'before':
-					nonmatching.append(consumed)
+			consumed   = ''.join(letterlist[:consume])
+			letterlist = letterlist[consume:]
 
-				elif position == 'after':
-					nonmatching[-1] += consumed
-					nonmatching.append('')
+			if position == 'before':
+				nonmatching.append(consumed)
 
-				else:
-					nonmatching.extend([consumed, ''])
+			elif position == 'after':
+				nonmatching[-1] += consumed
+				nonmatching.append('')
 
 			else:
-				nonmatching[-1] += letterlist.pop(0)
+				nonmatching.extend([consumed, ''])
+
+		else:
+			nonmatching[-1] += letterlist.pop(0)
 
-		yield tuple(x for x in nonmatching if x)
+	return tuple(x for x in nonmatching if x)
 
 
 # -------------------------------------------------------------------------------------------------
@@ -114,9 +130,10 @@ def twocommon(what):
 	return False, 1
 
 
-def choose_randomly(what):
-	''' Nondeterministic.  Pick a random method from METHOD_MAPPING.'''
-	return random.choice(list(METHOD_MAPPING.items()))[1](what)
+def choose_randomly(what, rng=random):
+	''' Nondeterministic.  Pick a random method from METHOD_MAPPING using `rng`.'''
+	method = rng.choice(list(METHOD_MAPPING.values()))
+	return method(what, rng) if method is choose_randomly else method(what)
 
 
 METHOD_MAPPING = {
@@ -129,6 +146,289 @@ METHOD_MAPPING = {
 }
 
 
+# -------------------------------------------------------------------------------------------------
+#
+# Sharded training: count transitions for each input file in parallel, then sum the counts.
+#
+# -------------------------------------------------------------------------------------------------
+
+def RememberEntries(names, seen, similar=None):
+	'''
+	Filter each of `names` in turn, remembering it (capitalized) in `seen` as it passes.  Each is also indexed
+	in `similar`, if given.
+	'''
+
+	for name in names:
+		entry = FilterWord(name, LETTERS_AND_SPACES)
+		seen.Add(entry.capitalize())
+		if similar is not None:
+			similar.Add(entry)
+		yield entry
+
+
+def StreamEntries(files, seen, similar=None):
+	'''
+	Stream the filtered names in `files` one at a time, remembering each (capitalized) in `seen` as it passes,
+	so training never holds more than a single name in memory.  Each is also indexed in `similar`, if given.
+	'''
+	return RememberEntries(TraceIterable('parse.names', YieldNames(files)), seen, similar)
+
+
+def TrainShard(fname, method, split, capacity, seed=None, similar=None):
+	'''
+	Map step.  Partition the names in a single input file and count their transitions.
+	Returns the mergeable count table along with a BloomFilter of the (capitalized) names that were read.
+	'''
+
+	rng    = random.Random(None if seed is None else f'{seed}:{fname}')
+	seen   = BloomFilter(capacity)
+	counts = CountTransitions(TraceIterable('partition', PartitionGroup(StreamEntries([fname], seen, similar), METHOD_MAPPING[method], split, rng)))
+
+	return counts, seen
+
+
+def ShardCachePath(cachedir, fname, method, split, capacity):
+	'''
+	Where the trained shard for an input file is cached, or None if it can't be cached.
+	The path changes whenever the file (or how it's partitioned) does, so stale shards are never reused.
+	'''
+
+	# Random partitioning produces a different model every time, so reusing one would be misleading.
+	if not cachedir or method == 'random' or split == 'random' or fname == '-':
+		return None
+
+	stat = os.stat(fname)
+	key  = repr((os.path.abspath(fname), stat.st_mtime_ns, stat.st_size, method, split, capacity))
+
+	return os.path.join(cachedir, hashlib.sha1(key.encode()).hexdigest() + '.shard')
+
+
+def _TrainShardInWorker(*args):
+	'''TrainShard in a worker process, returning the shard along with the worker's timings (see TraceInWorker).'''
+	return TraceInWorker(TrainShard, *args)
+
+
+def TrainSharded(chain, files, method, split, capacity, jobs=None, cachedir=None, seed=None, similar=None):
+
+	'''
+	Train `chain` from `files`, one shard per file.  Shards missing from `cachedir` are partitioned and counted
+	across `jobs` processes, and then every shard's counts are summed and merged into the chain.
+
+	Returns a BloomFilter (sized for `capacity` names) of the (capitalized) training names.  If given, `similar`
+	indexes the training names too, which takes another pass over the files trained elsewhere.
+	'''
+
+	# Shards are kept by their position in `files`, so a file listed twice is counted twice.
+	shards  = {}
+	pending = []
+
+	for position, fname in enumerate(files):
+
+		path = ShardCachePath(cachedir, fname, method, split, capacity)
+
+		# Worker processes can't read our stdin, so it's always trained here.
+		if fname == '-':
+			shards[position] = TrainShard(fname, method, split, capacity, seed, similar)
+
+		elif path and os.path.exists(path):
+			with open(path, 'rb') as f:
+				shards[position] = pickle.load(f)
+
+		else:
+			pending.append(position)
+
+	names = [files[x] for x in pending]
+
+	with ProcessPoolExecutor(jobs) as pool, Span('train.shards'):
+		for position, fname, (shard, trace) in zip(pending, names, pool.map(_TrainShardInWorker, names, repeat(method), repeat(split), repeat(capacity), repeat(seed))):
+
+			MergeWorkerTrace(trace)
+			shards[position] = shard
+
+			path = ShardCachePath(cachedir, fname, method, split, capacity)
+			if path:
+				os.makedirs(cachedir, exist_ok=True)
+
+				# Write aside and rename into place, so a crash never leaves a truncated shard to load.
+				with open(path + '.tmp', 'wb') as f:
+					pickle.dump(shard, f)
+				os.replace(path + '.tmp', path)
+
+	# Reduce step.
+	total = Counter()
+	seen  = BloomFilter(capacity)
+
+	for counts, names in shards.values():
+		total.update(counts)
+		seen.Union(names)
+
+	with Span('train.merge'):
+		chain.UpdateTransitionCounts(total)
+
+	if similar is not None:
+		for fname in files:
+			if fname != '-':
+				for name in TraceIterable('parse.names', YieldNames([fname])):
+					similar.Add(FilterWord(name, LETTERS_AND_SPACES))
+
+	return seen
+
+
+# -------------------------------------------------------------------------------------------------
+#
+# Family training: partition every name with several methods and splits in one pass over the inputs.
+#
+# -------------------------------------------------------------------------------------------------
+def ParseVariants(specs, split='around'):
+	'''Turn METHOD[:SPLIT] strings (splitting at `split` by default) into a list of (method, split) pairs.  Raises ValueError.'''
+
+	variants = []
+	for spec in specs:
+		method, _, position = spec.partition(':')
+		position = position or split
+
+		if method not in METHOD_MAPPING or position not in ('around', 'before', 'after', 'random'):
+			raise ValueError(f'Cannot train a chain split "{spec}".  Methods: {sorted(METHOD_MAPPING)}, splits: around, before, after, random')
+
+		if (method, position) not in variants:
+			variants.append((method, position))
+
+	return variants
+
+
+def TrainFamily(args, variants, seen, similar=None):
+
+	'''
+	Train a chain for each (method, split) pair in `variants` from a single read of `args.input`.  Each name
+	is read, filtered and remembered in `seen` (and `similar`) once, then split apart by every variant in turn.
+
+	Terms are interned in one vocabulary for the whole family, so a term shared by several chains (every
+	single letter, say) is only stored once.  Each chain is seeded as if it had been trained on its own.
+
+	Returns a dictionary of the chains named 'METHOD:SPLIT'.
+	'''
+
+	vocabulary = {}
+	members    = []
+
+	for method, split in variants:
+
+		rng      = random.Random(args.seed)
+		whatfunc = METHOD_MAPPING[method]
+		if whatfunc is choose_randomly:
+			whatfunc = functools.partial(choose_randomly, rng=rng)
+
+		members.append((f'{method}:{split}', whatfunc, split, rng, Counter()))
+
+	with Span('train.family'):
+		for entry in StreamEntries(args.input, seen, similar):
+			for _, whatfunc, split, rng, counts in members:
+
+				terms = [vocabulary.setdefault(x, x) for x in map(str.lower, PartitionWord(entry, whatfunc, split, rng))]
+				if terms:
+					counts.update(zip([None] + terms, terms + [None]))
+
+	family = {}
+
+	with Span('train.merge'):
+		for (name, _, split, _, counts), (method, _) in zip(members, variants):
+			family[name] = MarkovChainHandler(argparse.Namespace(**{ **vars(args), 'method' : method, 'split' : split }))
+			family[name].UpdateTransitionCounts(counts)
+
+	return family
+
+
+def ScoreNames(chain, names, direction='forward'):
+
+	'''
+	Returns the log-probability of `chain` generating each of `names`, partitioning them with the same method and
+	split the chain was trained with (see MarkovChainHandler.Score).
+	'''
+
+	params = chain.Params()
+
+	if params.method is None or params.split is None:
+		raise ValueError('The chain doesn\'t record the --method and --split it was trained with, so can\'t score names')
+
+	if params.method == 'random' or params.split == 'random':
+		raise ValueError('Only chains trained with a deterministic --method and --split can score names')
+
+	entries = (FilterWord(x, LETTERS_AND_SPACES) for x in names)
+	return chain.Score(PartitionGroup(entries, METHOD_MAPPING[params.method], params.split), direction)
+
+
+def ParseWeights(specs):
+	'''Turn NAME=WEIGHT strings into a dictionary of weights.  Raises ValueError.'''
+
+	weights = {}
+	for spec in specs:
+		name, _, weight = spec.partition('=')
+		weights[name] = float(weight or 1)
+
+	return weights
+
+
+def TrainChain(args):
+
+	'''
+	Build the chain described by the command line `args` (see below): attach to the shared chain named by
+	`args.attach`, mix the shared chains weighted by `args.mix`, mix a family of chains trained together for each
+	of `args.family` (see TrainFamily), or train one from `args.input`, sharded across processes if asked to.
+
+	Returns the chain, a BloomFilter of the (capitalized) training names and, if `args.distance` asks for one, a
+	NearDuplicateIndex of the training names (otherwise None).
+	'''
+
+	seen     = BloomFilter(args.expected_names)
+	mix      = getattr(args, 'mix', None)
+	family   = getattr(args, 'family', None)
+	distance = getattr(args, 'distance', 0)
+	similar  = NearDuplicateIndex(distance) if distance > 0 else None
+
+	if args.attach or mix:
+
+		# Nothing is trained from the input here, so it can all be read before sizing the filter to fit it.
+		names = list(TraceIterable('parse.names', YieldNames(args.input)))
+		seen  = BloomFilter(max(args.expected_names, len(names)))
+
+		for _ in RememberEntries(names, seen, similar):
+			pass
+
+		if mix:
+			weights = ParseWeights(mix)
+			chain   = MixtureChainHandler(args, { x : SharedChainHandler(args, x) for x in weights }, weights)
+		else:
+			chain   = SharedChainHandler(args, args.attach)
+
+	elif family:
+		chain = MixtureChainHandler(args, TrainFamily(args, ParseVariants(family, args.split), seen, similar))
+
+	else:
+		chain = MarkovChainHandler(args)
+
+		if args.jobs > 1 or args.shard_cache:
+			seen = TrainSharded(chain, args.input, args.method, args.split, args.expected_names, args.jobs, args.shard_cache, args.seed, similar)
+
+		else:
+			entries = PartitionGroup(StreamEntries(args.input, seen, similar), METHOD_MAPPING[args.method], args.split, random.Random(args.seed))
+
+			for entry in TraceIterable('partition', entries):
+				if entry:
+					with Span('train'):
+						chain.UpdateTermString(entry)
+
+	if similar is not None:
+		with Span('index.similar'):
+			similar.Freeze()
+
+	capacity = seen.Overfull()
+	if capacity:
+		print(f'Warning: read {len(seen)} names into a filter sized for {capacity}, so generated names will be wrongly '
+		      f'rejected as training names more often.  Raise --expected-names to fix this.', file=sys.stderr)
+
+	return chain, seen, similar
+
+
 # -------------------------------------------------------------------------------------------------
 # Drive the program fooooooorward into the future!
 # -------------------------------------------------------------------------------------------------
@@ -146,8 +446,12 @@ if __name__ == '__main__':
 	ap.add_argument('-s', '--start', nargs='+',
 		help='A series of letter or letters names must start with.')
 
-	ap.add_argument('-i', '--input', required=True, nargs='+',
-		help='Input file(s) containing a list of names.  Each file must have one word/name per line.')
+	ap.add_argument('-i', '--input', nargs='+', default=[],
+		help='Input file(s) containing a list of names.  Each file must have one word/name per line.  '
+		     'Files may be compressed (.gz, .bz2, .xz), and "-" reads names from stdin.')
+
+	ap.add_argument('--expected-names', type=int, default=1000000,
+		help='Roughly how many training names there are.  Sizes the compact filter used to reject generated names that were in the input.')
 
 	ap.add_argument('--method', default='letters',
 		choices = set(METHOD_MAPPING),
@@ -157,25 +461,205 @@ if __name__ == '__main__':
 		choices = ('around', 'before', 'after', 'random'),
 		help    = 'When splitting a word apart (specified via -m/--method), determine how to break apart the word at a given separation point.')
 
+	ap.add_argument('--family', nargs='+', metavar='METHOD[:SPLIT]',
+		help='Train a chain for each of these methods (split as in --split unless given) in one pass over the input, and generate from an even mixture of them.  --score and --analyze report on each chain.')
+
+	ap.add_argument('-j', '--jobs', type=int, default=1,
+		help='Train each input file as a separate shard, partitioning and counting up to this many files at once.')
+
+	ap.add_argument('--shard-cache',
+		help='Directory that trained shards are cached in, so unchanged input files are not retrained.  Implies sharded training.')
+
+	ap.add_argument('--prune-count', type=int, default=1,
+		help='After training, drop transitions seen fewer than this many times.')
+
+	ap.add_argument('--prune-probability', type=float, default=0.0,
+		help='After training, drop transitions making up less than this fraction of the transitions from a term.')
+
+	ap.add_argument('--prune-terms', type=int, default=1,
+		help='After training, drop terms seen fewer than this many times.')
+
+	ap.add_argument('--quantize-bits', type=int,
+		help='After training, rescale the transition counts of each term to fit in integers of this many bits.')
+
+	ap.add_argument('--seed', type=int,
+		help='Seed the random choices made while training and generating, so a run can be reproduced.')
+
+	ap.add_argument('--temperature', type=float, default=1.0,
+		help='Below 1, favor the most common transitions when generating names.  Above 1, make rare transitions more likely.')
+
+	ap.add_argument('--top-p', type=float, default=1.0,
+		help='Only pick from the most likely transitions making up this fraction of the probability at each step.')
+
+	ap.add_argument('--stats', action='store_true',
+		help='When finished, print how many names were generated, accepted and rejected (and why) to stderr.')
+
+	ap.add_argument('--timings', action='store_true',
+		help='When finished, print how much time each stage (parsing, training, sampling, ...) took to stderr.')
+
+	ap.add_argument('--trace', metavar='FILE',
+		help='Write the time spent in each stage to FILE as Chrome trace events (view them in chrome://tracing or Perfetto).')
+
+	ap.add_argument('--profile', metavar='FILE',
+		help='Profile the run with cProfile, saving the pstats to FILE and printing the most expensive calls to stderr.')
+
+	ap.add_argument('--analyze', action='store_true',
+		help='Instead of generating names, print a JSON report of the size and shape of the trained chain.')
+
+	ap.add_argument('--best', type=int, metavar='COUNT',
+		help='Instead of sampling names, print the COUNT most probable new names (and their log-probabilities), most probable first.')
+
+	ap.add_argument('--distance', type=int, default=0,
+		help='Also reject names within this many edits (inserted, deleted or changed letters) of a training name.')
+
+	ap.add_argument('--beam-width', type=int, default=10000,
+		help='With --best, the number of partial names kept while searching.  Larger is more exact but uses more memory.')
+
+	ap.add_argument('--score', nargs='+', metavar='FILE',
+		help='Instead of generating names, print the log-probability of the chain generating each name in these files ("-" for stdin).')
+
+	ap.add_argument('--score-direction', default='forward',
+		choices = ('forward', 'backward'),
+		help    = 'Whether --score reads names start to end or end to start.')
+
+	ap.add_argument('--share', metavar='NAME',
+		help='Instead of generating names, publish the trained chain into shared memory as NAME for --attach, until interrupted.  Only the transitions --direction generates from are published.')
+
+	ap.add_argument('--attach', metavar='NAME',
+		help='Generate names from a chain published with --share instead of training one.  Any --input only marks names as already seen.')
+
+	ap.add_argument('--mix', nargs='+', metavar='NAME=WEIGHT',
+		help='Generate names from a weighted mixture of chains published with --share, instead of training one.  Any --input only marks names as already seen.')
+
 	args = ap.parse_args()
 
+	if not args.input and not args.attach and not args.mix:
+		ap.error('an --input is required unless generating from an --attach\'ed or --mix\'ed chain')
+
+	if args.family and (args.attach or args.mix or args.jobs > 1 or args.shard_cache or args.best or args.share):
+		ap.error('--family trains its chains together in this process, so can\'t be combined with --attach, --mix, --jobs, --shard-cache, --best or --share')
+
+	compacting = args.prune_count > 1 or args.prune_probability > 0 or args.prune_terms > 1 or args.quantize_bits
+
+	if args.attach and compacting:
+		ap.error('--attach\'ed chains are read-only, so can\'t be used with --prune-*/--quantize-bits')
+
+	if args.mix and (args.best or args.analyze or args.score or args.share or compacting):
+		ap.error('--mix\'ed chains are blended while sampling, so can only generate names, not be used with --best, --analyze, --score, --share or --prune-*/--quantize-bits')
+
 	if args.minlen >= args.maxlen or args.minlen < 1 or args.maxlen < 1:
 		raise ValueError('The --minlen and --maxlen parameters must be larger than zero and a valid increasing range from minlen to maxlen')
 
-	args.method = METHOD_MAPPING[args.method]
+	if args.stats:
+		atexit.register(lambda: print(STATS.Summary(), file=sys.stderr))
+
+	StartTracing(args.timings, args.trace, args.profile)
+
+	if args.distance < 0:
+		raise ValueError('The --distance parameter must not be negative')
+
+	try:
+		chain, seen, similar = TrainChain(args)
+	except ValueError as e:
+		ap.error(str(e))
+
+	def IsNew(name):
+		'''Whether a (capitalized) name is neither seen yet nor too close to a training name, counting why not.'''
+
+		if name in seen:
+			STATS.Count('names.rejected.seen')
+			return False
+
+		if similar is not None and name in similar:
+			STATS.Count('names.rejected.near_duplicate')
+			return False
 
-	entries = [FilterWord(x, LETTERS_AND_SPACES) for x in YieldNames(args.input)]
+		return True
 
-	chain = MarkovChainHandler(args)
-	for entry in PartitionGroup(entries, args.method, args.split):
-		chain.UpdateTermString(entry)
+	# The chains trained together by --family, or just the one chain.
+	members = chain.Models() if args.family else { None : chain }
 
-	seen = set([x.capitalize() for x in entries])
+	if compacting:
+
+		for name, member in members.items():
+
+			report = member.Compact(args.prune_count, args.prune_probability, args.prune_terms, args.quantize_bits or 64)
+
+			if name:
+				print(name)
+			for key in report['before']:
+				print('{:<16} {:>14} => {:<14}'.format(key, *(round(report[x][key], 4) for x in ('before', 'after'))))
+			print('Entropy change: {:+.4f} bits per transition\n'.format(report['entropy_change']))
+
+		# Compacting may have dropped terms the mixture knew of.
+		if args.family:
+			chain = MixtureChainHandler(args, members)
+
+	if args.analyze:
+		if args.family:
+			print(json.dumps({ name : member.Analyze() for name, member in members.items() }, indent='\t'))
+		else:
+			chain.Debug()
+		sys.exit(0)
+
+	if args.best:
+		best = ((score, name.capitalize()) for score, name in chain.YieldMostProbable(args.beam_width))
+
+		for score, name in islice(((x, y) for x, y in best if IsNew(y)), args.best):
+			print(f'{score:.4f}\t{name}')
+
+		sys.exit(0)
+
+	if args.score:
+		names = YieldNames(args.score)
+
+		if args.family:
+			print('\t'.join(list(members) + ['name']))
+
+		# Score in large batches so any number of names can be scored.
+		while 1:
+			batch = list(islice(names, 1 << 16))
+			if not batch:
+				break
+
+			try:
+				scores = [ScoreNames(x, batch, args.score_direction) for x in members.values()]
+			except ValueError as e:
+				sys.exit(f'Cannot score names: {e}')
+
+			for name, *score in zip(batch, *scores):
+				print('\t'.join(f'{x:.4f}' for x in score) + f'\t{name}')
+
+		sys.exit(0)
+
+	if args.share:
+		shared = SharedChainHandler.Publish(chain, args.share, SAMPLED_TABLES[args.direction])
+		print(f'Sharing the chain as "{shared.Name()}".  Press Ctrl+C to stop sharing it.')
+
+		# Treat being terminated like Ctrl+C so the shared memory is always cleaned up.
+		signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+		try:
+			while 1:
+				time.sleep(3600)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			shared.Unlink()
+
+		sys.exit(0)
+
+	# Names were piped in, so prompt from the terminal (if there is one) instead.
+	if '-' in args.input:
+		try:
+			sys.stdin = open('/dev/tty')
+		except OSError:
+			pass
 
 	# Terminate generation if we don't see anything new after a certain number of name generations.
 	TERMINATION_COUNT = 2048
 	terminate_after   = TERMINATION_COUNT
-	
+
 	while terminate_after:
 	
 		generated = chain.GenerateChain()	
@@ -183,10 +667,11 @@ if __name__ == '__main__':
 		
 			stringified = ''.join(generated).strip().capitalize()
 			
-			if stringified not in seen:
+			if IsNew(stringified):
 			
+				STATS.Count('names.accepted')
 				terminate_after = TERMINATION_COUNT
-				seen.add(stringified)
+				seen.Add(stringified)
 
 				aligned     = '{:<' + str(args.maxlen + 1) + '}'
 				show_name   = '{} =>'.format(aligned.format(stringified))
@@ -0,0 +1,604 @@
+#!/usr/bin/env python
+
+import sys, argparse, asyncio, json, math, os, random, signal, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+
+from namegen import TrainChain, METHOD_MAPPING
+from namegen_utils import *
+
+# Stop looking for new names if we don't see anything new after a certain number of name generations.
+TERMINATION_COUNT = 2048
+
+# The most names a single request can ask for.
+MAX_COUNT = 1000
+
+# The longest names (minlen and maxlen) a request can ask for.
+MAX_LENGTH = 100
+
+# -------------------------------------------------------------------------------------------------
+# ModelPool
+# -------------------------------------------------------------------------------------------------
+class ModelPool(object):
+
+	'''
+	Trained chains, kept warm for as long as the server runs and looked up by name, along with a filter of the
+	names each was trained on (so they're never served back).  Chains are only read once they're added, so any
+	number of threads can generate from the pool at once.
+	'''
+
+	def __init__(self, defaults):
+		self._models   = {}
+		self._defaults = defaults
+		self._mixture  = None
+
+	def Add(self, name, chain, seen, similar=None):
+		chain.Prepare()
+		if similar is not None:
+			similar.Freeze()
+		self._models[name] = (chain, seen, similar)
+		self._mixture      = None
+
+	def Mixture(self):
+		'''Returns a MixtureChainHandler over every model, which requests can blend with their own weights.'''
+
+		if self._mixture is None:
+			self._mixture = MixtureChainHandler(argparse.Namespace(**{ **vars(self._defaults), 'start' : None }), { k : v[0] for k, v in self._models.items() })
+			self._mixture.Prepare()
+
+		return self._mixture
+
+	def Names(self):
+		return list(self._models)
+
+	def ParseRequest(self, fields):
+
+		'''
+		Validate one request, given as a dict of fields (all optional):
+
+			model     : Name of the model to generate with.  Defaults to the first model loaded.
+			count     : How many names to generate.
+			start     : A prefix (or list of prefixes) names must start with.
+			minlen    : Minimum length of the names.
+			maxlen    : Generation stops once a name is at least this long.
+			direction : 'forward', 'backward' or 'bidirectional'.
+			temperature, top_p : Reshape the probabilities of transitions (see MarkovChainHandler.GenerateChain).
+			mix       : Instead of a single model, generate from a mixture of models weighted like { "name" : weight, ... }.
+
+		Returns the model name, the name count and the params to generate names with.  Raises ValueError.
+		'''
+
+		unknown = set(fields) - { 'model', 'count', 'start', 'minlen', 'maxlen', 'direction', 'temperature', 'top_p', 'mix' }
+		if unknown:
+			raise ValueError(f'Unknown request fields: {sorted(unknown)}')
+
+		model = fields.get('model', next(iter(self._models), None))
+		if not isinstance(model, str) or model not in self._models:
+			raise ValueError(f'No model named "{model}".  Models: {self.Names()}')
+
+		mix = fields.get('mix')
+		if mix is not None and not isinstance(mix, dict):
+			raise ValueError('mix must be an object of model names and weights')
+
+		start = fields.get('start') or None
+		if isinstance(start, str):
+			start = start.split(',')
+		if start is not None and not (isinstance(start, list) and all(isinstance(x, str) for x in start)):
+			raise ValueError('start must be a prefix or a list of prefixes')
+
+		params = argparse.Namespace(
+			minlen      = int(fields.get('minlen', self._defaults.minlen)),
+			maxlen      = int(fields.get('maxlen', self._defaults.maxlen)),
+			direction   = fields.get('direction', self._defaults.direction),
+			start       = start,
+			temperature = float(fields.get('temperature', self._defaults.temperature)),
+			top_p       = float(fields.get('top_p',       self._defaults.top_p)),
+			weights     = mix and { k : float(v) for k, v in mix.items() },
+		)
+
+		count = int(fields.get('count', 1))
+
+		if not 1 <= count <= MAX_COUNT:
+			raise ValueError(f'count must be between 1 and {MAX_COUNT}')
+		if params.minlen >= params.maxlen or params.minlen < 1 or params.maxlen > MAX_LENGTH:
+			raise ValueError(f'minlen and maxlen must be a valid increasing range from minlen to maxlen, between 1 and {MAX_LENGTH}')
+		if not isinstance(params.direction, str) or params.direction not in ('forward', 'backward', 'bidirectional'):
+			raise ValueError('direction must be "forward", "backward" or "bidirectional"')
+		if not 0 < params.temperature < math.inf or not 0 < params.top_p <= 1:
+			raise ValueError('temperature must be positive, and top_p between 0 (exclusive) and 1')
+
+		return model, count, params
+
+	def Generate(self, fields, rng):
+
+		'''
+		Generate the names asked for by one request.  Names the model was trained on or that were already generated
+		for this request are skipped, so fewer names than asked for are returned if the model runs out of new ones.
+		'''
+
+		model, count, params = self.ParseRequest(fields)
+		chain, seen, similar = self._models[model]
+
+		if params.weights:
+			model   = 'mix'
+			chain   = self.Mixture()
+			seen    = [x for _, x, _ in self._models.values()]
+			similar = [x for _, _, x in self._models.values() if x is not None]
+		else:
+			seen    = [seen]
+			similar = [similar] if similar is not None else []
+
+		names           = []
+		terminate_after = TERMINATION_COUNT
+
+		while terminate_after and len(names) < count:
+
+			generated = chain.GenerateChain(rng, params)
+			if generated:
+
+				stringified = ''.join(generated).strip().capitalize()
+
+				if any(stringified in x for x in seen):
+					STATS.Count('names.rejected.seen')
+
+				elif any(stringified in x for x in similar):
+					STATS.Count('names.rejected.near_duplicate')
+
+				elif stringified in names:
+					STATS.Count('names.rejected.duplicate')
+
+				else:
+					STATS.Count('names.accepted')
+					terminate_after = TERMINATION_COUNT
+					names.append(stringified)
+					continue
+
+			terminate_after -= 1
+
+		return { 'model' : model, 'names' : names }
+
+	def GenerateBatch(self, requests, rng):
+		'''
+		Answer every request in `requests`, giving back a reply (or a ValueError describing why it failed) for each.
+		A request failing in any way never stops the others being answered.
+		'''
+
+		replies = []
+		for fields in requests:
+			try:
+				replies.append(self.Generate(fields, rng))
+			except (ValueError, TypeError) as e:
+				replies.append(ValueError(str(e)))
+			except Exception as e:
+				print(f'Failed to answer {fields!r}: {e!r}', file=sys.stderr)
+				replies.append(ValueError(f'Failed to generate names: {type(e).__name__}'))
+
+		return replies
+
+
+# -------------------------------------------------------------------------------------------------
+# RequestBatcher
+# -------------------------------------------------------------------------------------------------
+class RequestBatcher(object):
+
+	'''
+	Coalesces requests arriving within `delay` seconds of each other (up to `size` of them) so each group is
+	generated with a single hop into a worker thread, keeping the event loop free to accept more requests.
+	Each of the `workers` consumers has its own thread and random.Random instance.
+	'''
+
+	def __init__(self, pool, size=64, delay=0.002, workers=1, seed=None):
+
+		self._pool     = pool
+		self._size     = max(1, size)
+		self._delay    = delay
+		self._queue    = asyncio.Queue()
+		self._executor = ThreadPoolExecutor(workers)
+		self._tasks    = [
+			asyncio.ensure_future(self._Run(random.Random(None if seed is None else f'{seed}:{i}')))
+			for i in range(workers)
+		]
+
+	async def Submit(self, fields):
+		'''Queue one request, returning its reply once it's been generated.'''
+
+		future = asyncio.get_running_loop().create_future()
+		await self._queue.put((fields, future))
+
+		reply = await future
+		if isinstance(reply, Exception):
+			raise reply
+
+		return reply
+
+	async def Answer(self, payload):
+		'''Answer a request, or a list of requests (which are generated together).'''
+
+		if isinstance(payload, list):
+			return await asyncio.gather(*map(self.Submit, payload), return_exceptions=True)
+
+		if not isinstance(payload, dict):
+			raise ValueError('A request must be an object or a list of objects')
+
+		return await self.Submit(payload)
+
+	async def _Run(self, rng):
+
+		loop = asyncio.get_running_loop()
+
+		while 1:
+
+			batch    = [await self._queue.get()]
+			deadline = loop.time() + self._delay
+
+			while len(batch) < self._size:
+
+				if not self._queue.empty():
+					batch.append(self._queue.get_nowait())
+					continue
+
+				remaining = deadline - loop.time()
+				if remaining <= 0:
+					break
+
+				try:
+					batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+				except asyncio.TimeoutError:
+					break
+
+			# Only this batch's requests fail if something goes wrong, so the server keeps answering later ones.
+			try:
+				replies = await loop.run_in_executor(self._executor, self._pool.GenerateBatch, [x for x, _ in batch], rng)
+			except Exception as e:
+				print(f'Failed to generate a batch of {len(batch)} requests: {e!r}', file=sys.stderr)
+				replies = [ValueError(f'Failed to generate names: {type(e).__name__}')] * len(batch)
+
+			for (_, future), reply in zip(batch, replies):
+				if not future.done():
+					future.set_result(reply)
+
+	def Close(self):
+		for task in self._tasks:
+			task.cancel()
+		self._executor.shutdown(wait=False)
+
+
+def Jsonify(reply):
+	'''Make a reply (or a list of replies, some of which may have failed) JSON-serializable.'''
+
+	if isinstance(reply, list):
+		return [Jsonify(x) for x in reply]
+
+	if isinstance(reply, Exception):
+		return { 'error' : str(reply) }
+
+	return reply
+
+
+# -------------------------------------------------------------------------------------------------
+# Protocols
+# -------------------------------------------------------------------------------------------------
+async def ServeLines(batcher, reader, writer):
+
+	'''
+	Unix socket protocol.  Every line sent is a JSON request (or list of requests), answered by a single line of JSON.
+	'''
+
+	try:
+		while 1:
+
+			line = await reader.readline()
+			if not line:
+				break
+
+			try:
+				reply = await batcher.Answer(json.loads(line))
+			except ValueError as e:
+				reply = e
+
+			writer.write(json.dumps(Jsonify(reply)).encode() + b'\n')
+			await writer.drain()
+
+	except ConnectionError:
+		pass
+
+	finally:
+		writer.close()
+
+
+async def ServeHTTP(batcher, pool, reader, writer):
+
+	'''
+	A minimal HTTP/1.1 protocol (with keep-alive), speaking JSON:
+
+		GET  /models                                       : Names of the loaded models.
+		GET  /stats                                        : The generation counters (see GenerationStats).
+		GET  /names?count=10&start=ka&minlen=3&maxlen=8   : One request, given as query parameters.
+		POST /names                                        : One request, or a list of them, as a JSON body.
+	'''
+
+	try:
+		while 1:
+
+			request_line = await reader.readline()
+			if not request_line.strip():
+				break
+
+			method, target, version = request_line.decode('latin-1').split(None, 2)
+
+			headers = {}
+			while 1:
+				line = (await reader.readline()).decode('latin-1')
+				if not line.strip():
+					break
+				key, _, value = line.partition(':')
+				headers[key.strip().lower()] = value.strip()
+
+			body = await reader.readexactly(int(headers.get('content-length', 0)))
+			url  = urlsplit(target)
+
+			status = '200 OK'
+			try:
+				if url.path == '/models':
+					reply = { 'models' : pool.Names() }
+
+				elif url.path == '/stats':
+					reply = STATS.Snapshot()
+
+				elif url.path == '/names' and method == 'GET':
+					reply = await batcher.Answer(dict(parse_qsl(url.query)))
+
+				elif url.path == '/names' and method == 'POST':
+					reply = await batcher.Answer(json.loads(body))
+
+				else:
+					status, reply = '404 Not Found', ValueError(f'Nothing at {method} {url.path}')
+
+			except ValueError as e:
+				status, reply = '400 Bad Request', e
+
+			keep_alive = version.strip() == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+			content    = json.dumps(Jsonify(reply)).encode()
+
+			writer.write(
+				f'HTTP/1.1 {status}\r\n'
+				f'Content-Type: application/json\r\n'
+				f'Content-Length: {len(content)}\r\n'
+				f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + content
+			)
+			await writer.drain()
+
+			if not keep_alive:
+				break
+
+	except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+		pass
+
+	finally:
+		writer.close()
+
+
+def ParseAddress(address):
+	'''Split a HOST:PORT address.'''
+	host, _, port = address.rpartition(':')
+	return host or '127.0.0.1', int(port)
+
+
+async def Serve(pool, args):
+
+	batcher = RequestBatcher(pool, args.batch_size, args.batch_delay / 1000, args.workers, args.seed)
+	servers = []
+
+	if args.unix:
+		if os.path.exists(args.unix):
+			os.unlink(args.unix)
+		servers.append(await asyncio.start_unix_server(lambda r, w: ServeLines(batcher, r, w), args.unix))
+		print(f'Serving names on the Unix socket {args.unix}')
+
+	if args.http:
+		host, port = ParseAddress(args.http)
+		servers.append(await asyncio.start_server(lambda r, w: ServeHTTP(batcher, pool, r, w), host, port))
+		print(f'Serving names on http://{host}:{port}/names')
+
+	sys.stdout.flush()
+
+	stop = asyncio.Event()
+	for signum in (signal.SIGINT, signal.SIGTERM):
+		asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+
+	try:
+		await stop.wait()
+	finally:
+		for server in servers:
+			server.close()
+			await server.wait_closed()
+		batcher.Close()
+		if args.unix and os.path.exists(args.unix):
+			os.unlink(args.unix)
+
+
+# -------------------------------------------------------------------------------------------------
+# Load generator
+# -------------------------------------------------------------------------------------------------
+async def LoadClient(args, fields, requests, latencies):
+
+	'''Send `requests` requests one after the other over a single connection, recording how long each took.'''
+
+	if args.unix:
+		reader, writer = await asyncio.open_unix_connection(args.unix)
+		message        = json.dumps(fields).encode() + b'\n'
+	else:
+		host, port     = ParseAddress(args.http)
+		reader, writer = await asyncio.open_connection(host, port)
+		body           = json.dumps(fields).encode()
+		message        = (
+			f'POST /names HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+			f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body
+		)
+
+	names = 0
+
+	for _ in range(requests):
+
+		began = time.perf_counter()
+		writer.write(message)
+
+		if args.unix:
+			reply = json.loads(await reader.readline())
+		else:
+			length = 0
+			while 1:
+				line = (await reader.readline()).decode('latin-1')
+				if not line.strip():
+					break
+				if line.lower().startswith('content-length:'):
+					length = int(line.split(':', 1)[1])
+			reply = json.loads(await reader.readexactly(length))
+
+		latencies.append(time.perf_counter() - began)
+
+		if 'error' in reply:
+			raise ValueError(reply['error'])
+		names += len(reply['names'])
+
+	writer.close()
+	return names
+
+
+async def GenerateLoad(args):
+
+	'''
+	Hammer a running server with `args.requests` requests from `args.concurrency` connections, and report the
+	throughput and latency percentiles as JSON.
+	'''
+
+	fields = { 'count' : args.count }
+	if args.target_model: fields['model'] = args.target_model
+	if args.start:        fields['start'] = args.start
+
+	concurrency = max(1, min(args.concurrency, args.requests))
+	shares      = [args.requests // concurrency + (i < args.requests % concurrency) for i in range(concurrency)]
+	latencies   = []
+
+	began   = time.perf_counter()
+	names   = await asyncio.gather(*(LoadClient(args, fields, x, latencies) for x in shares))
+	elapsed = time.perf_counter() - began
+
+	latencies.sort()
+	percentile = lambda p: round(1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+	return {
+		'requests'           : len(latencies),
+		'concurrency'        : concurrency,
+		'seconds'            : round(elapsed, 3),
+		'requests_per_second': round(len(latencies) / elapsed, 1),
+		'names_per_second'   : round(sum(names) / elapsed, 1),
+		'latency_ms'         : { 'p50' : percentile(0.50), 'p95' : percentile(0.95), 'p99' : percentile(0.99), 'max' : percentile(1.0) },
+	}
+
+
+# -------------------------------------------------------------------------------------------------
+# Drive the program fooooooorward into the future!
+# -------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+	ap = argparse.ArgumentParser('Serves names from trained chains kept in memory, or generates load against such a server')
+
+	ap.add_argument('-m', '--model', action='append', default=[], metavar='NAME=FILE[,FILE...]',
+		help='Train a model called NAME from the given files when starting.  May be repeated.')
+
+	ap.add_argument('--attach', action='append', default=[], metavar='NAME',
+		help='Serve a chain published with "namegen.py --share NAME" as the model NAME.  May be repeated.')
+
+	ap.add_argument('--unix', metavar='PATH', help='Unix socket to serve (or, with --loadgen, send) newline-delimited JSON requests on.')
+	ap.add_argument('--http', metavar='[HOST:]PORT', help='Address to serve (or, with --loadgen, send) HTTP requests on.')
+
+	ap.add_argument('--minlen', type=int, default=4,  help='Minimum string length of generated names, unless a request says otherwise.')
+	ap.add_argument('--maxlen', type=int, default=13, help='Force markov chain termination if the name is at least this size, unless a request says otherwise.')
+
+	ap.add_argument('-d', '--direction', default='forward',
+		choices = ('forward', 'backward', 'bidirectional'),
+		help    = 'Direction names are generated in, unless a request says otherwise.')
+
+	ap.add_argument('--temperature', type=float, default=1.0,
+		help='Temperature names are generated with, unless a request says otherwise.')
+
+	ap.add_argument('--top-p', type=float, default=1.0,
+		help='Fraction of the most likely transitions names are generated from, unless a request says otherwise.')
+
+	ap.add_argument('--method', default='letters',
+		choices = set(METHOD_MAPPING),
+		help    = 'Determine how letters in words will be split apart before the probability list is constructed.')
+
+	ap.add_argument('--split', default='around',
+		choices = ('around', 'before', 'after', 'random'),
+		help    = 'When splitting a word apart (specified via --method), determine how to break apart the word at a given separation point.')
+
+	ap.add_argument('--expected-names', type=int, default=1000000,
+		help='Roughly how many training names each model has.')
+
+	ap.add_argument('-j', '--jobs', type=int, default=1,
+		help='Train each input file as a separate shard, partitioning and counting up to this many files at once.')
+
+	ap.add_argument('--shard-cache',
+		help='Directory that trained shards are cached in, so unchanged input files are not retrained.  Implies sharded training.')
+
+	ap.add_argument('--seed', type=int,
+		help='Seed the random choices made while training and generating.')
+
+	ap.add_argument('--distance', type=int, default=0,
+		help='Also skip names within this many edits (inserted, deleted or changed letters) of a name the model was trained on.')
+
+	ap.add_argument('--batch-size', type=int, default=64,
+		help='Most requests generated together in one batch.')
+
+	ap.add_argument('--batch-delay', type=float, default=2.0,
+		help='Milliseconds to wait for more requests to batch with the first one.')
+
+	ap.add_argument('--workers', type=int, default=1,
+		help='Number of threads generating batches of names.')
+
+	ap.add_argument('--loadgen', action='store_true',
+		help='Instead of serving names, send requests to the server at --unix or --http and report how quickly they were answered.')
+
+	ap.add_argument('--requests', type=int, default=1000, help='With --loadgen, the number of requests sent.')
+	ap.add_argument('--concurrency', type=int, default=16, help='With --loadgen, the number of connections sending requests at once.')
+	ap.add_argument('--count', type=int, default=10, help='With --loadgen, the number of names asked for by each request.')
+	ap.add_argument('--target-model', help='With --loadgen, the model requests ask for.')
+	ap.add_argument('-s', '--start', help='With --loadgen, the prefix(es, comma separated) names must start with.')
+
+	args = ap.parse_args()
+
+	if not args.unix and not args.http:
+		ap.error('a --unix socket or --http address is required')
+
+	if args.loadgen:
+		try:
+			print(json.dumps(asyncio.run(GenerateLoad(args)), indent='\t'))
+		except (OSError, ValueError) as e:
+			sys.exit(f'Load generation failed: {e}')
+		sys.exit(0)
+
+	if not args.model and not args.attach:
+		ap.error('at least one --model or --attach is required')
+
+	pool = ModelPool(args)
+
+	for spec in args.model:
+
+		name, _, files = spec.partition('=')
+		if not files:
+			ap.error(f'--model must look like NAME=FILE[,FILE...], not "{spec}"')
+
+		began = time.perf_counter()
+		pool.Add(name, *TrainChain(argparse.Namespace(**{ **vars(args), 'input' : files.split(','), 'attach' : None, 'start' : None })))
+		print(f'Trained model "{name}" in {time.perf_counter() - began:.2f}s')
+
+	for name in args.attach:
+		try:
+			pool.Add(name, *TrainChain(argparse.Namespace(**{ **vars(args), 'input' : [], 'attach' : name, 'start' : None })))
+		except ValueError as e:
+			ap.error(str(e))
+		print(f'Attached to the shared chain "{name}"')
+
+	asyncio.run(Serve(pool, args))
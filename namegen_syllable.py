@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 
-import sys, operator, argparse, os
-from collections import defaultdict, deque
+import sys, operator, argparse, os, queue, threading, json, itertools, multiprocessing, contextlib, atexit
+from collections import defaultdict, deque, ChainMap
 
 from namegen_utils import *
 
+# Stop generating if nothing novel turns up after this many generations in a row.
+TERMINATION_COUNT = 2048
+
 # -------------------------------------------------------------------------------------------------
 # HistoryState
 # -------------------------------------------------------------------------------------------------
@@ -76,44 +79,94 @@ class HistoryState(object):
 		self._position = len(self._history) - 1
 
 # -------------------------------------------------------------------------------------------------
-# AdaptedCorpus
+# PrefetchQueue
 # -------------------------------------------------------------------------------------------------
-class AdaptedCorpus(object):
+class PrefetchQueue(object):
 
 	'''
-	A base/abstract class that provides an underlying list of syllabified names and parsed names,
-	and statically caches certain things that subclasses are likely to use.
+	Drains an iterable on a background thread into a bounded queue, so the consumer can pop entries
+	that are already prepared instead of paying for them when they're requested.
+
+	A maxsize of zero (or less) disables the background thread and produces entries on demand.
+	Exceptions raised by the producer are re-raised by the consumer on the next call to Pop.
 	'''
 
-	WORDS        = {}
-	PARSED_NAMES = {}
+	def __init__(self, iterable, maxsize=8):
 
-	def __init__(self, files):
+		self._iterator = iter(iterable)
+		self._queue    = None
 
-		# Don't reload a corpus we've already loaded. -------------------------
-		if AdaptedCorpus.WORDS:
-			return
+		if maxsize > 0:
+			self._queue  = queue.Queue(maxsize)
+			self._thread = threading.Thread(target=self._Produce, daemon=True)
+			self._thread.start()
 
-		# Load from the corpus ------------------------------------------------
-		# The corpus is solely used to determine good transitions of syllables,
-		# but isn't used during name generation.
+	def _Produce(self):
+		'''Keeps the queue topped up until the iterable is exhausted or fails.'''
 
-		print('Loading CMU dictionary.  This may take while...', end=' ')
+		try:
+			for item in self._iterator:
+				self._queue.put((True, item))
 
-		from nltk.corpus import cmudict
-		canned_words = cmudict.dict()
+			self._queue.put((False, IndexError('The prefetched iterable has been exhausted!')))
 
-		print('done!')
+		except Exception as e:
+			self._queue.put((False, e))
+
+	def Pop(self):
+		'''Returns the next entry, blocking only if the producer hasn't caught up yet.'''
+
+		if self._queue is None:
+			try:
+				return next(self._iterator)
+			except StopIteration:
+				raise IndexError('The prefetched iterable has been exhausted!')
+
+		succeeded, value = self._queue.get()
+		if not succeeded:
+			# Leave the failure in place so later calls see it too.
+			self._queue.put((succeeded, value))
+			raise value
+
+		return value
+
+# -------------------------------------------------------------------------------------------------
+# CorpusCache
+# -------------------------------------------------------------------------------------------------
+class CorpusCache(object):
+
+	'''
+	Caches loaded corpora so several name corpora can be held by one process at once.
+
+	Corpora are keyed on the CMU source and the set of input files along with their modification times,
+	so editing an input file (or asking for a different set of files) loads a fresh corpus.  The cleaned
+	CMU dictionary is cached separately and shared between every corpus built on top of it.  Both caches
+	evict their least recently used entries once they hold more than their size limit.
+	'''
+
+	def __init__(self, maxsize=4, cmuMaxsize=2):
+
+		self._corpora = LRUCache(maxsize)
+		self._cmu     = LRUCache(cmuMaxsize)
+
+	@staticmethod
+	def _SourceKey(cmu):
+		'''Identify a CMU source.  NLTK's corpus is represented by None.'''
+		return None if cmu is None else (os.path.abspath(cmu), os.path.getmtime(cmu))
 
-		# Load from files -----------------------------------------------------
+	@staticmethod
+	def _FilesKey(files):
+		'''Identify a set of input files, including when they were last modified.'''
+		return frozenset((os.path.abspath(f), os.path.getmtime(f)) for f in files)
 
-		AdaptedCorpus.PARSED_NAMES = ObtainSyllables(files)
+	@staticmethod
+	def _Clean(items):
 
+		'''Remove terms with non-word symbols and strip the stress numbers from their syllables.'''
 
-		# Process all corpus terms and input terms ----------------------------
-		print('Removing terms with non-word symbols, cleaning up remaining terms...', end=' ')
+		words = {}
 
-		for word, syllable_groups in YieldAllFrom(canned_words.items(), AdaptedCorpus.PARSED_NAMES.items()):
+		for word, syllable_groups in items:
 
 			filtered_name = FilterLetters(word)
 
@@ -124,9 +177,82 @@ class AdaptedCorpus(object):
 				for syllable_group in syllable_groups:
 					pronunciations.append([RemoveNumbers(x) for x in syllable_group])
 
-				AdaptedCorpus.WORDS[filtered_name] = pronunciations
+				words[filtered_name] = pronunciations
 
-		print('done!')
+		return words
+
+	def _CleanedCMU(self, cmu):
+
+		'''Returns the cleaned CMU dictionary for a source, loading it if it isn't cached.'''
+
+		key   = self._SourceKey(cmu)
+		words = self._cmu.Get(key)
+
+		if words is None:
+
+			# The corpus is solely used to determine good transitions of syllables,
+			# but isn't used during name generation.
+			print('Loading CMU dictionary.  This may take while...', end=' ')
+			canned_words = LoadCMUDictionary(cmu)
+			print('done!')
+
+			print('Removing terms with non-word symbols, cleaning up remaining terms...', end=' ')
+			words = self._Clean(canned_words.items())
+			print('done!')
+
+			self._cmu.Put(key, words)
+
+		return words
+
+	def Get(self, files, cmu=None):
+
+		'''
+		Returns a (words, parsed_names) pair for the input files, loading it if it isn't cached.
+
+		`words` maps every cleaned CMU and input term to its pronunciations, with input terms taking precedence.
+		`parsed_names` maps each input name to its set of syllabifications.
+		'''
+
+		key    = (self._SourceKey(cmu), self._FilesKey(files))
+		corpus = self._corpora.Get(key)
+
+		if corpus is None:
+
+			parsed_names = ObtainSyllables(files)
+
+			# Layer the input terms over the (shared) CMU terms rather than copying the CMU terms per corpus.
+			words  = ChainMap(self._Clean(parsed_names.items()), self._CleanedCMU(cmu))
+			corpus = (words, parsed_names)
+
+			self._corpora.Put(key, corpus)
+
+		return corpus
+
+	def Evict(self, files, cmu=None):
+		'''Drop the corpus for a set of input files.  The CMU dictionary stays cached for other corpora.'''
+		self._corpora.Evict((self._SourceKey(cmu), self._FilesKey(files)))
+
+	def Clear(self):
+		'''Drop every cached corpus and CMU dictionary.'''
+		self._corpora.Clear()
+		self._cmu.Clear()
+
+
+CORPUS_CACHE = CorpusCache()
+
+# -------------------------------------------------------------------------------------------------
+# AdaptedCorpus
+# -------------------------------------------------------------------------------------------------
+class AdaptedCorpus(object):
+
+	'''
+	A base/abstract class that provides an underlying list of syllabified names and parsed names,
+	shared through CORPUS_CACHE with every other instance built from the same inputs.
+	'''
+
+	def __init__(self, files, cmu=None):
+
+		self.WORDS, self.PARSED_NAMES = CORPUS_CACHE.Get(files, cmu)
 
 # -------------------------------------------------------------------------------------------------
 # Node
@@ -176,9 +302,9 @@ class Node(object):
 class Transcriber(AdaptedCorpus):
 	'''Reverse a set of syllables into a jumble of letters that might be reasonable.'''
 
-	def __init__(self, files):
+	def __init__(self, files, cmu=None):
 
-		AdaptedCorpus.__init__(self, files)
+		AdaptedCorpus.__init__(self, files, cmu)
 
 		print('Constructing associations with syllables...', end=' ')
 
@@ -186,7 +312,7 @@ class Transcriber(AdaptedCorpus):
 		self._associations = Node(None, None)
 
 		# Constuct a syllable list to word lookup from the list of words we've parsed.
-		for word, dialect in AdaptedCorpus.WORDS.items():
+		for word, dialect in self.WORDS.items():
 			for pronunciation in dialect:
 				self._associations.Update(pronunciation, word)
 
@@ -203,7 +329,8 @@ class Transcriber(AdaptedCorpus):
 		print('done!')
 
 	def Transcribe(self, syllables):
-		return list(self._associations.YieldSolutions(syllables))
+		with Span('transcribe'):
+			return list(self._associations.YieldSolutions(syllables))
 
 # -------------------------------------------------------------------------------------------------
 # ImpossibleFilter
@@ -216,9 +343,9 @@ class ImpossibleFilter(AdaptedCorpus):
 	given both the input set of names and the pronunciation dictionary.
 	'''
 
-	def __init__(self, filenames):
+	def __init__(self, filenames, cmu=None):
 
-		AdaptedCorpus.__init__(self, filenames)
+		AdaptedCorpus.__init__(self, filenames, cmu)
 
 		syllables = set()
 		self.probabilities = {
@@ -230,7 +357,7 @@ class ImpossibleFilter(AdaptedCorpus):
 		syl_count = 0
 		let_count = 0
 
-		for word, syllable_group in AdaptedCorpus.WORDS.items():
+		for word, syllable_group in self.WORDS.items():
 
 			# Keep track of letter combinations that don't occur frequently
 			# Use three-letter combinations as filters because only using two-syllable terms
@@ -284,7 +411,7 @@ class ImpossibleFilter(AdaptedCorpus):
 		# transition in the event our input names differ from the typical English corpus.
 		print('Constructing input overrides...', end=' ')
 
-		for _, syllable_groups in AdaptedCorpus.PARSED_NAMES.items():
+		for _, syllable_groups in self.PARSED_NAMES.items():
 			for each_group in syllable_groups:
 				# Do syllable mappings between each syllable and following syllable
 				for i in range(len(each_group)-1):
@@ -293,9 +420,13 @@ class ImpossibleFilter(AdaptedCorpus):
 
 		print('done!')
 
-	def HasImpossibleCombinations(self, what):
+	def JudgeCombination(self, what):
 
-		''' Return if a word has combinations of letters that aren't consistent with the corpus or name list. '''
+		'''
+		Find the first syllable combination that isn't consistent with the corpus or name list, returning the reason
+		('impossible' or 'unlikely') along with a description of it, or (None, None) if every combination looks
+		reasonable.  This never prints, so it is safe to call away from the console (e.g. from a prefetching thread).
+		'''
 
 		for j in range(len(what)-1):
 
@@ -305,15 +436,13 @@ class ImpossibleFilter(AdaptedCorpus):
 				continue
 
 			if pairing not in self.probabilities['syllable']:
-				print('Impossible syllable combination: {:^2} -> {:^2}'.format(*pairing))
-				return True
+				return 'impossible', 'Impossible syllable combination: {:^2} -> {:^2}'.format(*pairing)
 
 			# This constant can be tuned.  It wasn't picked in some type of optimial analysis, but seems to work fairly well.
 			if self.probabilities['syllable'][pairing] < 0.001:
-				print('Very unlikely syllable combination: {:^2} -> {:^2}'.format(*pairing))
-				return True
+				return 'unlikely', 'Very unlikely syllable combination: {:^2} -> {:^2}'.format(*pairing)
 
-		return False
+		return None, None
 
 	def HasDumbLetterCombinations(self, what):
 
@@ -334,70 +463,87 @@ class ImpossibleFilter(AdaptedCorpus):
 		return False
 
 # -------------------------------------------------------------------------------------------------
-# SoundManager
+# TranscribeSyllables
 # -------------------------------------------------------------------------------------------------
-class SoundManager():
+def TranscribeSyllables(syllables, transcriber, impossibleChecker):
 
-	'''Manages the phonetics of an input word provided to the system.'''
+	'''
+	Returns every plausible spelling of a list of syllables, shortest (and then alphabetically first) spellings first.
+	Spellings with unlikely letter combinations, without vowels, or shorter than three letters are discarded.
+	'''
 
-	def __init__(self, syllables, transcriber, impossibleChecker):
+	transcribed = []
+	
+	for grouping in ChunkSyllables(syllables):
 
-		self._history   = HistoryState('Sound Manager')
-		self._syllables = syllables
+		wordparts = []
+		for element in grouping:
 
-		transcribed = []
-		
-		for grouping in ChunkSyllables(syllables):
+			results = transcriber.Transcribe(element)
 
-			wordparts = []
-			for element in grouping:
+			if not results:
+				wordparts = []
+				break
 
-				results = transcriber.Transcribe(element)
+			else:
+				if not wordparts:
+					wordparts += results
+				else:
+					tmp = []
+					for result in results:
+						for existing in wordparts:
+							tmp.append(existing+result)
+					wordparts = tmp
 
-				if not results:
-					wordparts = []
-					break
+		if wordparts:
+			transcribed += wordparts
 
-				else:
-					if not wordparts:
-						wordparts += results
-					else:
-						tmp = []
-						for result in results:
-							for existing in wordparts:
-								tmp.append(existing+result)
-						wordparts = tmp
+	# Force transcriptions to have valid letter combinations.
+	transcribed = [x for x in transcribed if not impossibleChecker.HasDumbLetterCombinations(x)]
 
-			if wordparts:
-				transcribed += wordparts
+	# Force transcriptions to contain vowels
+	transcribed = [x for x in transcribed if any(z in x for z in VOWEL_SET) and len(x)]
 
-		# Force transcriptions to have valid letter combinations.
-		transcribed = [x for x in transcribed if not impossibleChecker.HasDumbLetterCombinations(x)]
+	# Force transcriptions to be at least three letters long
+	transcribed = [x for x in transcribed if len(x) >= 3]
 
-		# Force transcriptions to contain vowels
-		transcribed = [x for x in transcribed if any(z in x for z in VOWEL_SET) and len(x)]
+	transcribed = list(set(transcribed))
+	transcribed.sort()
+	transcribed.sort(key=len)
 
-		# Force transcriptions to be at least three letters long
-		transcribed = [x for x in transcribed if len(x) >= 3]
+	# Convert the string representations into a version without the u'thing' to make it more readable.
+	transcriptions = []
 
-		transcribed = list(set(transcribed))
-		transcribed.sort()
-		transcribed.sort(key=len)
+	replacements = [
+		["',", ','],
+		["['", '['],
+		["']", ']']
+	]
 
-		# Convert the string representations into a version without the u'thing' to make it more readable.
-		transcriptions = []
+	for element in transcribed:
+		for before, after in replacements:
+			element = element.replace(before, after)
 
-		replacements = [
-			["',", ','],
-			["['", '['],
-			["']", ']']
-		]
+		transcriptions.append(element)
 
-		for element in transcribed:
-			for before, after in replacements:
-				element = element.replace(before, after)
+	return transcriptions
 
-			transcriptions.append(element)
+# -------------------------------------------------------------------------------------------------
+# SoundManager
+# -------------------------------------------------------------------------------------------------
+class SoundManager():
+
+	'''Manages the phonetics of an input word provided to the system.'''
+
+	def __init__(self, syllables, transcriber, impossibleChecker):
+
+		self._history   = HistoryState('Sound Manager')
+		self._syllables = syllables
+
+		transcriptions = TranscribeSyllables(syllables, transcriber, impossibleChecker)
+
+		if not transcriptions:
+			STATS.Count('transcription.untranscribed')
 
 		for group in Chunk(transcriptions, 5):
 			self._history.AddHistory(group)
@@ -447,48 +593,111 @@ class SoundManager():
 		
 
 # -------------------------------------------------------------------------------------------------
-# InteractiveInterface
+# SyllableGenerator
 # -------------------------------------------------------------------------------------------------
-class InteractiveInterface(AdaptedCorpus):
+class SyllableGenerator(AdaptedCorpus):
 
-	'''The interface used to interact with the name generator'''
+	'''
+	Owns the corpus, markov chain and filters shared by the interactive and batch front ends, and
+	exposes name generation as chained generator stages: generation -> filter -> transcription.
+	'''
 
 	def __init__(self, args):
 
 		''' Sets up the corpus and markov chain information.'''
 
-		AdaptedCorpus.__init__(self, args.input)
+		AdaptedCorpus.__init__(self, args.input, args.cmu)
 
 		self._seenSyllables = set()
 		self._markov        = MarkovChainHandler(args)
-		self._impossible    = ImpossibleFilter(args.input)
-		self._transcriber   = Transcriber(args.input)
-		self._history       = HistoryState('Sound History', 16)
+		self._impossible    = ImpossibleFilter(args.input, args.cmu)
+		self._transcriber   = Transcriber(args.input, args.cmu)
 
-		for _, syllable_groups in AdaptedCorpus.PARSED_NAMES.items():
-			for each_group in syllable_groups:
-				self._markov.UpdateTermString(each_group)
+		with Span('train'):
+			for _, syllable_groups in self.PARSED_NAMES.items():
+				for each_group in syllable_groups:
+					self._markov.UpdateTermString(each_group)
 
-	def _CreateEntry(self):
+	def _YieldNovelSyllables(self):
+
+		'''
+		Do Markov chain generations, yielding each unique, novel set of syllables.  Stops once TERMINATION_COUNT
+		generations in a row turn up nothing novel.
+		'''
 
-		'''Do Markov chain generations until we end up with a unique, novel set of syllables.'''
+		terminate_after = TERMINATION_COUNT
 
-		while 1:
+		while terminate_after:
 
-			syllables = tuple(x.upper() for x in self._markov.GenerateChain())
+			terminate_after -= 1
 
-			if syllables is None or syllables in self._seenSyllables:
+			generated = self._markov.GenerateChain()
+			if generated is None:
 				continue
 
+			syllables = tuple(x.upper() for x in generated)
+			if syllables in self._seenSyllables:
+				STATS.Count('syllables.rejected.seen')
+				continue
+
+			STATS.Count('syllables.accepted')
 			self._seenSyllables.add(syllables)
+			terminate_after = TERMINATION_COUNT
+			yield syllables
 
-			if self._impossible.HasImpossibleCombinations(syllables):
-				#print(f'\tIgnoring {syllables} due to impossible/unlikely syllable combination.')
-				#continue
-				print(f'\tHas unmapped/impossible/unlikely syllable combinations:\n\t\t{syllables}')
+		print(f'Stopping: nothing novel was generated in {TERMINATION_COUNT} tries.', file=sys.stderr)
 
-			self._history.AddHistory(SoundManager(syllables, self._transcriber, self._impossible))
-			return
+	def _YieldVerdicts(self, stream):
+
+		'''Pair each set of syllables with the reason it looks impossible/unlikely (or None if it doesn't).'''
+
+		for syllables in stream:
+
+			with Span('filter'):
+				reason, verdict = self._impossible.JudgeCombination(syllables)
+			if reason:
+				STATS.Count(f'syllables.flagged.{reason}')
+
+			yield syllables, verdict
+
+	def _YieldEntries(self, stream):
+
+		'''Transcribe each set of syllables into the SoundManager that displays it.'''
+
+		for syllables, verdict in stream:
+
+			with Span('transcribe.name'):
+				entry = SoundManager(syllables, self._transcriber, self._impossible)
+
+			yield entry, verdict
+
+# -------------------------------------------------------------------------------------------------
+# InteractiveInterface
+# -------------------------------------------------------------------------------------------------
+class InteractiveInterface(SyllableGenerator):
+
+	'''The interface used to interact with the name generator'''
+
+	def __init__(self, args):
+
+		SyllableGenerator.__init__(self, args)
+
+		self._history = HistoryState('Sound History', 16)
+
+		# Start filling the queue of ready-to-display entries while the user reads the current one.
+		self._prefetch = PrefetchQueue(self._YieldEntries(self._YieldVerdicts(self._YieldNovelSyllables())), args.prefetch)
+
+	def _CreateEntry(self):
+
+		'''Take the next unique, novel set of syllables off the prefetch queue.'''
+
+		entry, verdict = self._prefetch.Pop()
+
+		if verdict:
+			print(verdict)
+			print(f'\tHas unmapped/impossible/unlikely syllable combinations:\n\t\t{entry.Syllables()}')
+
+		self._history.AddHistory(entry)
 
 	def _Previous(self):
 
@@ -505,7 +714,15 @@ class InteractiveInterface(AdaptedCorpus):
 		''' Move to the next sound state and create a new entry as necessary.'''
 
 		if self._history.AtEnd() or not self._history:
-			self._CreateEntry()
+
+			try:
+				self._CreateEntry()
+			except IndexError:
+				if not self._history:
+					sys.exit('No names could be generated!')
+				print('\tNo more new names can be generated!')
+				return
+
 			self._history.Current().Activate()
 
 		else:
@@ -573,6 +790,86 @@ class InteractiveInterface(AdaptedCorpus):
 			exit(0)
 
 
+# -------------------------------------------------------------------------------------------------
+# BatchInterface
+# -------------------------------------------------------------------------------------------------
+
+# The generator used by batch worker processes.  Workers are forked after it's assigned, so they share
+# the loaded corpus with the parent instead of loading (or unpickling) their own copy.
+_BATCH_GENERATOR = None
+
+def _DescribeInWorker(syllables):
+	'''Filter and transcribe a set of syllables inside a worker process, returning the record and its timings.'''
+	return TraceInWorker(_BATCH_GENERATOR._Describe, syllables)
+
+
+class BatchInterface(SyllableGenerator):
+
+	'''Headless name generation, streaming each novel set of syllables as a line of JSON.'''
+
+	def __init__(self, args):
+
+		SyllableGenerator.__init__(self, args)
+
+		self._spellings = args.spellings
+
+	def _Describe(self, syllables):
+
+		'''Run the filter and transcription stages for a set of syllables, returning a JSON-ready record.'''
+
+		with Span('filter'):
+			reason, verdict = self._impossible.JudgeCombination(syllables)
+
+		with Span('transcribe.name'):
+			spellings = TranscribeSyllables(syllables, self._transcriber, self._impossible)
+
+		return {
+			'syllables'  : list(syllables),
+			'impossible' : verdict is not None,
+			'reason'     : reason,
+			'verdict'    : verdict,
+			'spellings'  : spellings[:self._spellings],
+		}
+
+	def _YieldRecords(self, count, workers):
+
+		'''
+		Yields records for `count` novel sets of syllables, in generation order.
+
+		Generation stays in this process since it tracks which syllables were already seen, while filtering and
+		transcription are fanned out to `workers` forked processes.  Platforms that can't fork run every stage here.
+		'''
+
+		global _BATCH_GENERATOR
+
+		stream = itertools.islice(self._YieldNovelSyllables(), count)
+
+		if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+			yield from map(self._Describe, stream)
+			return
+
+		_BATCH_GENERATOR = self
+		with multiprocessing.get_context('fork').Pool(workers) as pool:
+			for record, trace in pool.imap(_DescribeInWorker, stream, chunksize=16):
+				MergeWorkerTrace(trace)
+				yield record
+
+	def Stream(self, count, output, workers):
+
+		'''Write records for `count` novel sets of syllables to `output` as JSONL, flushing as each line is written.'''
+
+		for record in self._YieldRecords(count, workers):
+
+			# Records may come from worker processes, so they're counted here rather than where they're made.
+			if record['reason']:
+				STATS.Count(f'syllables.flagged.{record["reason"]}')
+			if not record['spellings']:
+				STATS.Count('transcription.untranscribed')
+
+			output.write(json.dumps(record) + '\n')
+			output.flush()
+
+
 # -------------------------------------------------------------------------------------------------
 # Drive the program fooooooorward into the future!
 # -------------------------------------------------------------------------------------------------
@@ -593,10 +890,57 @@ if __name__ == '__main__':
 		choices = ('forward', 'backward', 'bidirectional'),
 		help    = 'When generating names, specify if we generate forward (at the end of the word), backward, or in both directions randomly.')
 
+	ap.add_argument('--cmu',
+		help='A pronouncing dictionary in the plain-text cmudict format to use instead of NLTK\'s cmudict corpus.')
+
+	ap.add_argument('--stats', action='store_true',
+		help='When finished, print how many names were generated, accepted and rejected (and why) to stderr.')
+
+	ap.add_argument('--timings', action='store_true',
+		help='When finished, print how much time each stage (parsing, training, sampling, transcription, ...) took to stderr.')
+
+	ap.add_argument('--trace', metavar='FILE',
+		help='Write the time spent in each stage to FILE as Chrome trace events (view them in chrome://tracing or Perfetto).')
+
+	ap.add_argument('--profile', metavar='FILE',
+		help='Profile the run with cProfile, saving the pstats to FILE and printing the most expensive calls to stderr.')
+
+	ap.add_argument('--prefetch', type=int, default=8,
+		help='Number of entries to prepare in the background while the current one is shown.  Use 0 to prepare entries on demand.')
+
+	ap.add_argument('-b', '--batch', type=int, metavar='N',
+		help='Skip the interactive interface and stream N novel names as JSON lines instead.')
+
+	ap.add_argument('-o', '--output', default='-',
+		help='File the --batch JSON lines are written to.  Defaults to stdout.')
+
+	ap.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+		help='Number of processes filtering and transcribing names in --batch mode.')
+
+	ap.add_argument('--spellings', type=int, default=5,
+		help='Number of spellings recorded for each name in --batch mode.')
+
 	args = ap.parse_args()
 
 	if args.minlen >= args.maxlen or args.minlen < 1 or args.maxlen < 1:
 		raise ValueError('The --minlen and --maxlen parameters must be larger than zero and a valid increasing range from minlen to maxlen')
 
-	iface = InteractiveInterface(args)
-	iface.Display()
+	if args.stats:
+		atexit.register(lambda: print(STATS.Summary(), file=sys.stderr))
+
+	StartTracing(args.timings, args.trace, args.profile)
+
+	if args.batch is None:
+		iface = InteractiveInterface(args)
+		iface.Display()
+
+	else:
+		# Keep progress messages out of the JSON lines when they're written to stdout.
+		with contextlib.redirect_stdout(sys.stderr):
+			iface = BatchInterface(args)
+
+		if args.output == '-':
+			iface.Stream(args.batch, sys.stdout, args.workers)
+		else:
+			with open(args.output, 'w') as f:
+				iface.Stream(args.batch, f, args.workers)
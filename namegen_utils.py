@@ -1,5 +1,7 @@
-import random
-from collections import defaultdict, deque
+import random, threading, sys, string, os, tempfile, contextlib, copy, gzip, bz2, lzma, hashlib, math, bisect, json, mmap, heapq, time, atexit
+from array import array
+from itertools import repeat, accumulate
+from collections import defaultdict, deque, OrderedDict, Counter
 
 LOWERCASE          = 'abcdefghijklmnopqrstuvwxyz'
 UPPERCASE          = LOWERCASE.upper()
@@ -10,6 +12,22 @@ VOWEL_SET          = set('aeiouy')
 COMMON_LETTERS     = set('etaoinshrdlu')
 LETTERS_AND_SPACES = VALID_LETTER_SET | set(' ')
 
+# Rough cost of a single entry in the transition counts or sampling tables (a dict slot along with its key and value).
+TABLE_ENTRY_BYTES = 64
+
+# How many temperature / top-p sampling tables (one per term, direction and setting) a chain keeps around.
+SAMPLING_CACHE_SIZE = 1 << 16
+
+# How many lists of starting terms (one per set of `start` prefixes asked for) a chain keeps around.
+STARTING_TERMS_CACHE_SIZE = 256
+
+COMPRESSED_OPENERS = {
+	'.gz'   : gzip.open,
+	'.bz2'  : bz2.open,
+	'.xz'   : lzma.open,
+	'.lzma' : lzma.open,
+}
+
 def Chunk(l, s):
 	'''Return sublists of elements grouped in groups of size s.'''
 	for i in range(0, len(l), s):
@@ -29,19 +47,64 @@ def FilterWord(word, whitelist):
 	return ''.join(letter for letter in word if letter in whitelist)
 
 
+def OpenInput(fname):
+	'''
+	Open an input file for reading text.  Files ending in .gz, .bz2 or .xz are decompressed as they're read,
+	and "-" reads from stdin (which is left open afterwards).
+	'''
+
+	if fname == '-':
+		return contextlib.nullcontext(sys.stdin)
+
+	opener = COMPRESSED_OPENERS.get(os.path.splitext(fname)[1].lower(), open)
+	return opener(fname, 'rt')
+
+
 def ValidLines(fname):
 	'''
 	Returns all lines in a file that contain letters.
 	All trailing whitespace is stripped from the entry.
 	'''
 
-	with open(fname, 'r') as f:
+	with OpenInput(fname) as f:
 		for each_line in f:
 			stripped = each_line.rstrip()
 			if stripped:
 				yield stripped
 
 
+def AtomicWrite(fname, text):
+	'''
+	Replace the contents of `fname` with `text` by writing a temporary file next to it and renaming it into place,
+	so readers (or a crash) never observe a partially written file.  The file keeps its permissions, or gets the
+	usual ones (0666 less the umask) if it's new.
+	'''
+
+	directory = os.path.dirname(os.path.abspath(fname))
+	handle, tmpname = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(fname) + '.', suffix='.tmp')
+
+	try:
+		mode = os.stat(fname).st_mode & 0o7777
+	except FileNotFoundError:
+		umask = os.umask(0)
+		os.umask(umask)
+		mode  = 0o666 & ~umask
+
+	try:
+		with os.fdopen(handle, 'w') as f:
+			f.write(text)
+			f.flush()
+			os.chmod(f.fileno(), mode)
+			os.fsync(f.fileno())
+
+		os.replace(tmpname, fname)
+
+	except BaseException:
+		if os.path.exists(tmpname):
+			os.remove(tmpname)
+		raise
+
+
 def ChunkSyllables(syllables):
 	'''
 	Group an ordered list of syllables into chunks of syllables, such that a raw list of [a, b, c] will yield the following results:
@@ -77,10 +140,99 @@ def YieldNames(files):
 	'''
 	for f in files:
 		for line in ValidLines(f):
-			if line.strip() == line:
+			if not line[0].isspace():
 				yield line
 
 
+class SyllableTable(object):
+
+	'''
+	The result of ParseSyllableFiles.
+
+	`names` maps each name to the set of its syllabifications.  Every syllable string is interned and identical
+	syllabifications share a single tuple, so large corpora with a small syllable inventory stay compact.
+
+	`duplicates` maps each name that was seen more than once to every file it was seen in (including repeats).
+	'''
+
+	__slots__ = ('names', 'duplicates')
+
+	def __init__(self):
+		self.names      = {}
+		self.duplicates = {}
+
+	def Summary(self, limit=10):
+		'''Describe the duplicated names in a single message, or return an empty string if there weren't any.'''
+
+		if not self.duplicates:
+			return ''
+
+		shown = sorted(self.duplicates)[:limit]
+		rest  = len(self.duplicates) - len(shown)
+
+		summary = f'Saw {len(self.duplicates)} names multiple times: ' + ', '.join(f'{x} {self.duplicates[x]}' for x in shown)
+		if rest:
+			summary += f', and {rest} more'
+
+		return summary
+
+
+def ParseSyllableFiles(files, includeEmpty=False, chunksize=1 << 20):
+	'''
+	Bulk parser behind ObtainSyllables.  Reads each file `chunksize` bytes worth of lines at a time, returning a SyllableTable.
+
+	Names are lines without leading whitespace, and every indented line after a name is a space-delimited syllabification
+	of it.  Syllable lines that appear before the first name in a file don't belong to anything and are skipped.
+	'''
+
+	table      = SyllableTable()
+	names      = table.names
+	firstSeen  = {}
+	groups     = {}
+	intern     = sys.intern
+	whitespace = string.whitespace
+
+	for fname in files:
+
+		name      = None
+		syllables = None
+
+		with OpenInput(fname) as f:
+			for lines in iter(lambda: f.readlines(chunksize), []):
+				for line in lines:
+
+					line = line.rstrip()
+					if not line:
+						continue
+
+					if line[0] not in whitespace:
+
+						if line in firstSeen:
+							table.duplicates.setdefault(line, [firstSeen[line]]).append(fname)
+						else:
+							firstSeen[line] = fname
+							if includeEmpty:
+								names[intern(line)] = set()
+
+						syllables = names.get(line)
+						name      = line
+
+					elif name is not None:
+
+						# Most syllabifications repeat across names, so only split and intern the ones we haven't seen.
+						text  = line.lstrip()
+						group = groups.get(text)
+						if group is None:
+							group = groups[text] = tuple(map(intern, text.split(' ')))
+
+						if syllables is None:
+							syllables = names[intern(name)] = set()
+
+						syllables.add(group)
+
+	return table
+
+
 def ObtainSyllables(files, includeEmpty=False):
 	'''
 	Captures all names that have syllable definitions.
@@ -88,290 +240,1828 @@ def ObtainSyllables(files, includeEmpty=False):
 	IncludeEmpty is a utility that returns all entries, even if
 	there aren't any syllables associated with them.  This can be
 	useful if we want to generate syllables for these words.
+
+	Names that appear multiple times are reported once, in a single summary.
 	'''
 
-	words = defaultdict(set)
-	word_to_file_map = defaultdict(list)
-	
-	for f in files:
+	with Span('parse.syllables'):
+		table = ParseSyllableFiles(files, includeEmpty)
 
-		lastWord = None
-		for line in ValidLines(f):
+	if table.duplicates:
+		print(table.Summary())
 
-			if line.strip() == line:
-			
-				word_to_file_map[line].append(f)
-				
-				if len(word_to_file_map[line]) > 1:
-					print(f'Saw the name {line} multiple times:', word_to_file_map[line])
-				elif includeEmpty:
-					words[line] = set()
-					
-				lastWord = line
+	return defaultdict(set, table.names)
 
-			else:
-				words[lastWord].add(tuple(line.strip().split(' ')))
 
-	return words
+def LoadCMUDictionary(source=None):
+	'''
+	Returns a CMU pronouncing dictionary mapping lowercase words to lists of pronunciations.
+
+	With no `source` this is NLTK's cmudict corpus.  Otherwise `source` is the path of a file in the
+	plain-text cmudict format ("WORD  P R AH0 N", with alternates written "WORD(2)" and ";;;" comments),
+	which doesn't require NLTK at all.
+	'''
+
+	if source is None:
+		from nltk.corpus import cmudict
+		return cmudict.dict()
 
+	words = defaultdict(list)
 
-class Transitions(object):
+	with open(source, 'r', encoding='latin-1') as f:
+		for line in f:
+			if not line.strip() or line.startswith(';;;'):
+				continue
+
+			word, *phonemes = line.split()
+			if word.endswith(')') and '(' in word:
+				word = word[:word.index('(')]
+
+			words[word.lower()].append(phonemes)
+
+	return dict(words)
+
+
+class BloomFilter(object):
 
 	'''
-	Markov chain implementation detail showing what appears before and after this element
-	in the sample data.
+	Compact, probabilistic set membership for strings.
+
+	Sized for `capacity` entries with a false positive rate of roughly `error_rate` at that load, it takes about
+	1.8 MB per million entries at the default rate -- a small fraction of the equivalent set of strings.  It never
+	reports an added entry as missing, but occasionally reports a missing entry as present.
+
+	Filters with the same capacity and error rate can be combined with Union.  Adding more than `capacity` entries
+	quietly raises the false positive rate, so the filter counts what it's given: see Overfull.
 	'''
 
-	__slots__ = ('_value', '_sources', '_transitionCache', '_prepared')
+	__slots__ = ('_bits', '_size', '_hashes', '_params', '_count')
 
-	def __init__(self, val):
+	def __init__(self, capacity=1000000, error_rate=0.001):
 
-		self._value = val
+		self._params = (capacity, error_rate)
+		self._size   = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+		self._hashes = max(1, int(round(self._size / capacity * math.log(2))))
+		self._bits   = bytearray((self._size + 7) // 8)
+		self._count  = 0
 
-		self._sources = {
-			'to'   : defaultdict(int),
-			'from' : defaultdict(int),
-		}
+	def __len__(self):
+		'''How many entries were added (duplicates included), which may be more than the filter was sized for.'''
+		return self._count
 
-		# Cascades is a weird construct without context -- the 'True' and 'False'
-		# indicate whether it's allowed to transition to a "None" key or not.
-		self._transitionCache = {
-			True  : {},
-			False : {},
-		}
+	def Overfull(self):
+		'''The capacity the filter was sized for, if more entries than that were added (otherwise None).'''
+		return self._params[0] if self._count > self._params[0] else None
 
-		self._prepared = False
+	def _Positions(self, entry):
+		'''Derive every bit position for an entry from a single hash (double hashing).'''
 
+		digest = hashlib.blake2b(entry.encode(), digest_size=16).digest()
+		first  = int.from_bytes(digest[:8], 'little')
+		second = int.from_bytes(digest[8:], 'little') | 1
 
-	def ConnectWith(self, whatterm, direction):
+		return ((first + i * second) % self._size for i in range(self._hashes))
 
-		'''
-		Connect this chain element with another element either before or after it.
+	def Add(self, entry):
+		'''Add an entry to the filter.'''
+		for position in self._Positions(entry):
+			self._bits[position >> 3] |= 1 << (position & 7)
+		self._count += 1
 
-		Directions must be the strings 'to' or 'from' for the _GenerateCache cache
-		to be generated properly.
-		'''
+	def __contains__(self, entry):
+		return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._Positions(entry))
 
-		self._sources[direction][whatterm] += 1
-		self._prepared = False
+	def Union(self, other):
+		'''Add every entry of another filter (with the same capacity and error rate) to this one.'''
 
+		if self._params != other._params:
+			raise ValueError(f'Cannot combine Bloom filters sized {self._params} and {other._params}!')
 
-	def _GenerateCache(self):
+		combined   = int.from_bytes(self._bits, 'little') | int.from_bytes(other._bits, 'little')
+		self._bits = bytearray(combined.to_bytes(len(self._bits), 'little'))
 
-		'''
-		This effectively creates a list representing the states we can transition to and from.
+		# Filters cached before they were counted have no count to add.
+		self._count += getattr(other, '_count', 0)
 
-		This perfectly represents the number of times we move to an arbitrary instance (if we move from this
-		object to the letter 'a' 10 times, the entry 'a' will be present in the list 10 times).
 
-		While this keeps code simple in the trivial case (random.choice(list)), this obviously can cause
-		problems with memory if the number of recorded transitions between elements are very large.
-		'''
+def EditDistance(first, second, limit):
+	'''
+	The Levenshtein distance between two strings, or `limit` + 1 as soon as it's certain to be more than `limit`.
+	'''
 
-		if not self._prepared:
+	if abs(len(first) - len(second)) > limit:
+		return limit + 1
 
-			# Iterate through to and from terms
-			for direction, transitions in self._sources.items():
+	previous = list(range(len(second) + 1))
 
-				# Generate dictionaries for ignoring and listening for "None" transitions.
-				# The "None" transition indicates that we're at the end of a word (if transitioning 'to'),
-				# or at the very start (if transitioning 'from').
-				for noNones in [True, False]:
+	for i, a in enumerate(first, 1):
+		current = [i]
+		for j, b in enumerate(second, 1):
+			current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
 
-					tmp_transition = {}
-					total = 0
+		if min(current) > limit:
+			return limit + 1
+		previous = current
 
-					for term, value in transitions.items():
+	return previous[-1]
 
-						# If we don't want 'None' terms and this is a 'None', ignore it.
-						if noNones and term is None:
-							continue
 
-						for j in range(total, total+value):
-							tmp_transition[j] = term
+class NearDuplicateIndex(object):
 
-						total += value
+	'''
+	Finds names within `distance` edits (insertions, deletions or substitutions) of any name added to it.
 
-					self._transitionCache[noNones][direction] = tmp_transition
+	Like SymSpell, every name is indexed under each string left by deleting up to `distance` of its letters.  Two
+	names can only be that close if they share one of these, so a lookup only compares the candidate against the
+	few names sharing its own deletions rather than against every name.
 
-			self._prepared = True
+	Each deletion is kept as one integer (a hash of the deletion above the name's number) in a single sorted
+	array, about 8 bytes apiece: roughly 10 per name at distance 1, and 50 at distance 2.
+	'''
 
+	HASH_BITS = 39
+	NAME_BITS = 24
 
-	def PickRandomTerm(self, direction, noNones=False):
+	def __init__(self, distance=1):
 
-		'''
-		Randomly pick an element connecting to this element in the desired direction ('to' or 'from).
-		If 'noNones' is true, it will only return None if this term doesn't connect to anything else in the specified direction.
-		'''
+		self._distance = distance
+		self._names    = []
+		self._keys     = array('q')
+		self._sorted   = True
 
-		self._GenerateCache()
+	def __len__(self):
+		return len(self._names)
 
-		transitions = self._transitionCache[noNones][direction]
-		if not transitions:
-			return None
+	def _Deletions(self, name):
+		'''Every distinct string made by deleting up to `distance` letters of a name, including the name itself.'''
 
-		return random.choice(transitions)
+		deletions = frontier = { name }
 
+		for _ in range(self._distance):
+			frontier   = { x[:i] + x[i + 1:] for x in frontier for i in range(len(x)) }
+			deletions |= frontier
 
-	def __str__(self):
+		return deletions
 
-		'''
-		Convert the object into a string that helps us understand what this means.
-		Since we have "None" values, there are some normally extraneous uses of str conversions that are required.
-		pprint.pformat doesn't like to align nicely, so I'm shipping my own formatting instead.
-		'''
-		
-		rep = [f'Transitions object representing [{self._value}]']
-		rep.append('{')
-		for k, v in self._sources.items():
-			fmt_size = max(len(str(x)) for x in v) + 2 # Account for quotes around the word
-			rep.append(f'\t{k}:')
-			for letter, count in v.items():
-			
-				rep.append('\t\t{} : {}'.format(
-					('{:>' + str(fmt_size) + '}').format('"' + str(letter) + '"'),
-					count))
-		
-		rep.append('}')
-	
-		return '\n'.join(rep)
+	def _Hash(self, deletion):
+		return (hash(deletion) & ((1 << self.HASH_BITS) - 1)) << self.NAME_BITS
 
+	def Add(self, name):
+		'''Index a name.  Call Freeze once every name is added.'''
 
-# -------------------------------------------------------------------------------------------------
-# MarkovChainHandler
-# -------------------------------------------------------------------------------------------------
-class MarkovChainHandler(object):
+		number = len(self._names)
+		if number >> self.NAME_BITS:
+			raise OverflowError(f'A NearDuplicateIndex holds at most {1 << self.NAME_BITS} names!')
 
-	def __init__(self, params):
+		name = name.lower()
+		self._names.append(name)
+		self._keys.extend(self._Hash(x) | number for x in self._Deletions(name))
+		self._sorted = False
 
-		self._connections = { None : Transitions(None) }
-		self._args  = params
-		self._start = None
+	def Freeze(self):
+		'''Sort the index for lookups.  Lookups freeze it themselves if needed, but that isn't thread-safe.'''
 
+		if not self._sorted:
+			self._keys   = array('q', sorted(self._keys))
+			self._sorted = True
 
-	def Debug(self):
-		''' Show all connections that the MarkovChainHandler has registered. '''
-		
-		# Sorting with actual "None" values in the data requires some obnoxious workarounds.)
-		for name, actual in sorted([(str(x), x) for x in self._connections]):
-			print(self._connections[actual], '\n')
-			
-	def _CacheStartingTerms(self):
-		'''
-		Rather than continuously try to find a valid starting term, pre-populate a list with valid terms
-		so we can simply draw from it during each name generation.
-		'''
-		
-		# Don't bother trying to recalculate this if we previously have done so.
-		if self._start or not self._args.start:
-			return
-		
-		collection = []
-		for prefix in [x.lower() for x in self._args.start]:
-			collection.extend([x for x in self._connections if x and x.startswith(prefix)])
+	def FindNear(self, name):
+		'''Returns an indexed name (lowercased) within `distance` edits of `name`, or None if there isn't one.'''
 
-		if not collection:
-			
-			# Show what terms we actually have populated.  If inputs to this change (for instance,
-			# random splitting of input terms), then the output here probably won't make as much
-			# sense.
-				
-			tmp = defaultdict(list)
-			for elem in map(str, self._connections):
-				tmp[elem[0]].append(elem)
-					
-			for k in sorted(tmp):
-				print(sorted(tmp[k]))
-				
-			raise ValueError(f'None of the starting terms ({self._args.start}) exist as elements in the Markov Chain handler!')
-				
-		self._start = list(collection)
-		
+		self.Freeze()
 
-	def UpdateTermString(self, terms):
+		name    = name.lower()
+		keys    = self._keys
+		mask    = (1 << self.NAME_BITS) - 1
+		checked = set()
 
-		''' Given an iterable sequence of terms, bidirectionally connect elements with their neighbors. '''
+		for deletion in self._Deletions(name):
 
-		# Ensure all terms exist. ---------------------------------------------
+			key = self._Hash(deletion)
+			end = key | mask
+			i   = bisect.bisect_left(keys, key)
 
-		terms = [x.lower() for x in terms]
-		
-		for term in terms:
-			if term not in self._connections:
-				self._connections[term] = Transitions(term)
+			while i < len(keys) and keys[i] <= end:
 
-		# Connect neighboring terms with each other. --------------------------
+				number = keys[i] & mask
+				if number not in checked:
+					checked.add(number)
 
-		for thisTerm, nextTerm in zip(terms[:-1], terms[1:]):
+					if EditDistance(name, self._names[number], self._distance) <= self._distance:
+						return self._names[number]
+				i += 1
 
-			self._connections[thisTerm].ConnectWith(nextTerm, 'to')
-			self._connections[nextTerm].ConnectWith(thisTerm, 'from')
+		return None
 
-		# Connect the starting and ending term with 'none.' -------------------
+	def __contains__(self, name):
+		return self.FindNear(name) is not None
 
-		self._connections[None].ConnectWith(terms[0], 'to')
-		self._connections[terms[0]].ConnectWith(None, 'from')
 
-		self._connections[terms[-1]].ConnectWith(None, 'to')
-		self._connections[None].ConnectWith(terms[-1], 'from')
-		
-		# Cache starting terms based on input arguments -----------------------
+class Tracer(object):
 
-		self._start = None
+	'''
+	Receives timed spans from each stage of name generation (parsing, partitioning, training, preparing caches,
+	sampling, filtering and transcription).  This default ignores them, at the cost of a function call per span.
+	Install a RecordingTracer with SetTracer (or StartTracing) to collect them.
+	'''
 
-	def GenerateChain(self):
+	_NOTHING = contextlib.nullcontext()
 
-		'''
-		Generates a sequence of elements based on input arguments specified in the constructor.
+	def Span(self, name):
+		'''Returns a context manager timing the code it wraps as a span called `name`.'''
+		return self._NOTHING
 
-		Returns either `None` or a sequence of elements
+	def Record(self, name, start, duration, tid=None):
 		'''
+		Record a span called `name` that began at `start` (a time.perf_counter() value) and took `duration` seconds,
+		in the thread `tid` (by default, the current one).
+		'''
+		pass
 
-		chain = deque()
-		self._CacheStartingTerms()
 
-		# By default, start using "None" to force generations to start with terms
-		# explicitly used in the input. This can be overridden by the args constructed
-		# with this class.
+class _TimedSpan(object):
 
-		starting_term = None
-		if self._start:		
-			starting_term = random.choice(self._start)
-			chain.append((starting_term))
+	__slots__ = ('_tracer', '_name', '_start')
 
-		else:
-			chain.append(self._connections[starting_term].PickRandomTerm('to', True))
+	def __init__(self, tracer, name):
+		self._tracer = tracer
+		self._name   = name
 
-		if chain[0] is None:
-			return None
+	def __enter__(self):
+		self._start = time.perf_counter()
 
-		# -----------------------------------------------------------------------------
-		# Generate the name until we think it's good.
-		# -----------------------------------------------------------------------------
+	def __exit__(self, *exc):
+		self._tracer.Record(self._name, self._start, time.perf_counter() - self._start)
 
-		while 1:
 
-			stringified = ''.join(x for x in chain if x)
-			if len(stringified) >= self._args.maxlen:
-				break
+class RecordingTracer(Tracer):
 
-			allowed_directions = []
-			if chain[0]  is not None and self._args.direction != 'forward':  allowed_directions.append('backward')
-			if chain[-1] is not None and self._args.direction != 'backward': allowed_directions.append('forward')
+	'''
+	Keeps the total time spent in each stage, along with the first `maxEvents` individual spans for a timeline.
+	Spans are inclusive: a stage consuming another (partitioning reads names as it goes) includes its time.
+	'''
 
-			if not allowed_directions:
-				if len(stringified) < self._args.minlen:
-					return None
-				return stringified
+	def __init__(self, maxEvents=1000000):
 
-			temp_direction = random.choice(allowed_directions)
+		self._totals    = defaultdict(lambda: [0, 0.0, 0.0])
+		self._events    = []
+		self._maxEvents = maxEvents
+		self._dropped   = 0
+		self._origin    = time.perf_counter()
+		self._lock      = threading.Lock()
 
-			if temp_direction == 'forward':
-				nextTerm = self._connections[chain[-1]].PickRandomTerm('to', len(chain) < self._args.minlen)
-				chain.append(nextTerm)
+	def Span(self, name):
+		return _TimedSpan(self, name)
+
+	def Record(self, name, start, duration, tid=None):
+
+		'''Record a span, as recorded by the thread `tid` (by default, the current one).'''
+
+		with self._lock:
+
+			total     = self._totals[name]
+			total[0] += 1
+			total[1] += duration
+			total[2]  = max(total[2], duration)
+
+			if len(self._events) < self._maxEvents:
+				self._events.append((name, start, duration, threading.get_ident() if tid is None else tid))
 			else:
-				nextTerm = self._connections[chain[0]].PickRandomTerm('from', len(chain) < self._args.minlen)
-				chain.appendleft(nextTerm)
+				self._dropped += 1
 
-		return tuple(x for x in chain if x)
+	def Summary(self):
+
+		'''Returns a table of the calls and time spent in each stage, most time first.'''
+
+		lines = ['{:<28} {:>10} {:>12} {:>12} {:>12}'.format('Stage', 'Calls', 'Total (s)', 'Mean (ms)', 'Max (ms)')]
+
+		for name, (calls, total, longest) in sorted(self._totals.items(), key=lambda x: -x[1][1]):
+			lines.append('{:<28} {:>10} {:>12.4f} {:>12.4f} {:>12.4f}'.format(name, calls, total, 1000 * total / calls, 1000 * longest))
+
+		if self._dropped:
+			lines.append(f'({self._dropped} spans past the first {self._maxEvents} were only totalled)')
+
+		return '\n'.join(lines)
+
+	def WriteChromeTrace(self, fname):
+
+		'''Write the recorded spans as Chrome trace events (load them in chrome://tracing or Perfetto).'''
+
+		pid    = os.getpid()
+		events = [
+			{
+				'name' : name,
+				'ph'   : 'X',
+				'ts'   : round(1e6 * (start - self._origin), 3),
+				'dur'  : round(1e6 * duration, 3),
+				'pid'  : pid,
+				'tid'  : tid,
+			}
+			for name, start, duration, tid in self._events
+		]
+
+		AtomicWrite(fname, json.dumps({ 'traceEvents' : events, 'displayTimeUnit' : 'ms' }))
+
+
+class _SpanCollector(Tracer):
+
+	'''Keeps every span recorded, to be handed to another process.'''
+
+	def __init__(self):
+		self.spans = []
+
+	def Span(self, name):
+		return _TimedSpan(self, name)
+
+	def Record(self, name, start, duration):
+		self.spans.append((name, start, duration))
+
+
+class _ProfileStats(object):
+
+	'''Profile stats collected by another process, in the form pstats.Stats.add accepts.'''
+
+	def __init__(self, stats):
+		self.stats = stats
+
+	def create_stats(self):
+		pass
+
+
+# The tracer every stage reports to.  Replace it with SetTracer.
+_TRACER = Tracer()
+
+# The profiler StartTracing started (if any), and the profile stats worker processes sent back to merge into it.
+_PROFILER        = None
+_WORKER_PROFILES = []
+
+def SetTracer(tracer):
+	'''Install the tracer every stage reports spans to, returning the previous one.'''
+
+	global _TRACER
+	previous, _TRACER = _TRACER, tracer
+	return previous
+
+
+def Span(name):
+	'''Returns a context manager reporting the code it wraps to the current tracer as a span called `name`.'''
+	return _TRACER.Span(name)
+
+
+def TraceIterable(name, iterable):
+	'''Report the time spent producing each item of `iterable` as a span called `name`.'''
+
+	if type(_TRACER) is Tracer:
+		return iterable
+
+	return _TracedIterable(_TRACER, name, iterable)
+
+
+def _TracedIterable(tracer, name, iterable):
+
+	iterator = iter(iterable)
+
+	while 1:
+
+		start = time.perf_counter()
+		try:
+			item = next(iterator)
+		except StopIteration:
+			return
+		finally:
+			tracer.Record(name, start, time.perf_counter() - start)
+
+		yield item
+
+
+def StartTracing(summary=False, trace=None, profile=None):
+
+	'''
+	Start collecting timings for the rest of the process, reporting them when it exits:
+
+		`summary` : Print a table of the time spent in each stage to stderr.
+		`trace`   : Write every span to this file as Chrome trace events.
+		`profile` : Run cProfile (on the main thread), saving its pstats to this file and printing the top entries to stderr.
+	'''
+
+	if summary or trace:
+
+		tracer = RecordingTracer()
+		SetTracer(tracer)
+
+		def Report():
+			if summary:
+				print(tracer.Summary(), file=sys.stderr)
+			if trace:
+				tracer.WriteChromeTrace(trace)
+
+		atexit.register(Report)
+
+	if profile:
+
+		import cProfile, pstats
+
+		global _PROFILER
+		profiler = _PROFILER = cProfile.Profile()
+		profiler.enable()
+
+		def Dump():
+			profiler.disable()
+			stats = pstats.Stats(profiler, stream=sys.stderr)
+			for worker in _WORKER_PROFILES:
+				stats.add(_ProfileStats(worker))
+			stats.dump_stats(profile)
+			stats.sort_stats('cumulative').print_stats(25)
+
+		atexit.register(Dump)
+
+
+def TraceInWorker(function, *args):
+
+	'''
+	Call `function(*args)` in a worker process forked from one collecting timings (see StartTracing), which would
+	otherwise lose the spans and profile recorded in the worker.  Returns the result along with what was recorded,
+	for the parent to pass to MergeWorkerTrace.
+	'''
+
+	collector = None if type(_TRACER) is Tracer else _SpanCollector()
+	previous  = SetTracer(collector) if collector else None
+	profiler  = None
+
+	if _PROFILER is not None:
+
+		import cProfile
+
+		# The parent's profiler was forked along with everything else, and only one can run at a time.
+		_PROFILER.disable()
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	try:
+		result = function(*args)
+
+	finally:
+		if collector:
+			SetTracer(previous)
+		if profiler:
+			profiler.disable()
+			profiler.create_stats()
+
+	return result, (os.getpid(), collector.spans if collector else [], profiler.stats if profiler else None)
+
+
+def MergeWorkerTrace(trace):
+	'''Report the spans and profile a worker recorded with TraceInWorker as part of this process's timings.'''
+
+	pid, spans, stats = trace
+
+	for name, start, duration in spans:
+		_TRACER.Record(name, start, duration, pid)
+
+	if stats:
+		_WORKER_PROFILES.append(stats)
+
+
+class GenerationStats(object):
+
+	'''
+	Counters for the name generation funnel: attempts, acceptances, rejections by reason, steps taken and how often
+	caches were built.  Keys are dotted names grouped by their first part ('generate.attempts', 'cache.compiles').
+
+	Counting is a single dictionary increment, cheap enough to leave on the hot path.  Counts made by several
+	threads at the same instant may occasionally be lost, so treat them as (very close) estimates there.
+	'''
+
+	def __init__(self):
+		self._counts = Counter()
+
+	def Count(self, key, amount=1):
+		self._counts[key] += amount
+
+	def Get(self, key):
+		return self._counts[key]
+
+	def Snapshot(self):
+		'''Returns a copy of every count.'''
+		return dict(self._counts)
+
+	def Reset(self):
+		self._counts.clear()
+
+	def Summary(self):
+
+		'''Returns every count as a readable report, along with a few rates derived from them.'''
+
+		counts = self._counts
+		lines  = ['Generation statistics:']
+		group  = None
+
+		for key in sorted(counts):
+			if key.split('.')[0] != group:
+				group = key.split('.')[0]
+				lines.append('')
+			lines.append('\t{:<40} {:>12}'.format(key, counts[key]))
+
+		derived = []
+		if counts['generate.attempts']:
+			derived.append(('steps per attempt',      counts['generate.steps'] / counts['generate.attempts']))
+			derived.append(('chains finished',        (counts['generate.completed'] + counts['generate.maxlen']) / counts['generate.attempts']))
+
+		for prefix in ('names', 'syllables'):
+			considered = counts[f'{prefix}.accepted'] + sum(v for k, v in counts.items() if k.startswith(f'{prefix}.rejected.'))
+			if considered:
+				derived.append((f'{prefix} accepted', counts[f'{prefix}.accepted'] / considered))
+
+		if derived:
+			lines.append('')
+			lines.extend('\t{:<40} {:>12.3f}'.format(*x) for x in derived)
+
+		return '\n'.join(lines)
+
+
+# Counters for everything generating names in this process.
+STATS = GenerationStats()
+
+
+class LRUCache(object):
+
+	'''
+	A size-bounded mapping that evicts the least recently used entry once more than `maxsize` entries are stored.
+	A `maxsize` of zero (or less) never evicts anything.
+	'''
+
+	def __init__(self, maxsize):
+
+		self._maxsize = maxsize
+		self._entries = OrderedDict()
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def __len__(self):
+		return len(self._entries)
+
+	def Get(self, key, default=None):
+		'''Returns the entry for `key`, marking it as the most recently used.'''
+
+		if key not in self._entries:
+			return default
+
+		self._entries.move_to_end(key)
+		return self._entries[key]
+
+	def Put(self, key, value):
+		'''Stores an entry, evicting the least recently used entries if the cache is full.'''
+
+		self._entries[key] = value
+		self._entries.move_to_end(key)
+
+		while self._maxsize > 0 and len(self._entries) > self._maxsize:
+			self._entries.popitem(last=False)
+
+	def Evict(self, key):
+		'''Removes an entry if it exists.'''
+		self._entries.pop(key, None)
+
+	def Clear(self):
+		'''Removes every entry.'''
+		self._entries.clear()
+
+
+def CountTransitions(termstrings):
+	'''
+	Tally the transitions MarkovChainHandler.UpdateTermString would record for each sequence of terms, as a Counter
+	of (term, next term) pairs where None stands for the start or end of a word.  Tables counted separately can be
+	summed (Counter.update) before they're merged into a chain with UpdateTransitionCounts.
+	'''
+
+	counts = Counter()
+
+	for terms in termstrings:
+
+		terms = [x.lower() for x in terms]
+		if not terms:
+			continue
+
+		counts.update(zip([None] + terms, terms + [None]))
+
+	return counts
+
+
+class Transitions(object):
+
+	'''
+	Markov chain implementation detail showing what appears before and after this element
+	in the sample data.
+	'''
+
+	__slots__ = ('_value', '_sources', '_transitionCache')
+
+	def __init__(self, val):
+
+		self._value = val
+
+		self._sources = {
+			'to'   : defaultdict(int),
+			'from' : defaultdict(int),
+		}
+
+		# Sampling tables keyed by (noNones, direction), where noNones indicates whether it's allowed
+		# to transition to a "None" key or not.  Each is only built the first time it's needed.
+		self._transitionCache = {}
+
+
+	def ConnectWith(self, whatterm, direction, count=1):
+
+		'''
+		Connect this chain element with another element either before or after it, `count` times.
+
+		Directions must be the strings 'to' or 'from' for the _GenerateCache cache
+		to be generated properly.
+		'''
+
+		self._sources[direction][whatterm] += count
+
+		if self._transitionCache:
+			self._transitionCache = {}
+
+
+	def _GenerateCache(self, direction, noNones):
+
+		'''
+		This effectively creates a list representing the states we can transition to (or from, depending on
+		`direction`), leaving out "None" if `noNones` is set.  Only this one table is built, and it's kept until
+		the transitions change.
+
+		This perfectly represents the number of times we move to an arbitrary instance (if we move from this
+		object to the letter 'a' 10 times, the entry 'a' will be present in the list 10 times).
+
+		While this keeps code simple in the trivial case (random.choice(list)), this obviously can cause
+		problems with memory if the number of recorded transitions between elements are very large.
+
+		The table is built aside and stored in one step, so threads racing to build it only repeat work.
+		'''
+
+		tmp_transition = self._transitionCache.get((noNones, direction))
+		if tmp_transition is not None:
+			return tmp_transition
+
+		STATS.Count('cache.transition_tables')
+
+		with Span('prepare.transitions'):
+
+			tmp_transition = {}
+			total = 0
+
+			# The "None" transition indicates that we're at the end of a word (if transitioning 'to'),
+			# or at the very start (if transitioning 'from').
+			for term, value in self._sources[direction].items():
+
+				# If we don't want 'None' terms and this is a 'None', ignore it.
+				if noNones and term is None:
+					continue
+
+				for j in range(total, total+value):
+					tmp_transition[j] = term
+
+				total += value
+
+		self._transitionCache[noNones, direction] = tmp_transition
+		return tmp_transition
+
+
+	def PickRandomTerm(self, direction, noNones=False, rng=random):
+
+		'''
+		Randomly pick an element connecting to this element in the desired direction ('to' or 'from), using `rng`.
+		If 'noNones' is true, it will only return None if this term doesn't connect to anything else in the specified direction.
+		'''
+
+		transitions = self._transitionCache.get((noNones, direction))
+		if transitions is None:
+			transitions = self._GenerateCache(direction, noNones)
+
+		if not transitions:
+			return None
+
+		return rng.choice(transitions)
+
+
+	def __str__(self):
+
+		'''
+		Convert the object into a string that helps us understand what this means.
+		Since we have "None" values, there are some normally extraneous uses of str conversions that are required.
+		pprint.pformat doesn't like to align nicely, so I'm shipping my own formatting instead.
+		'''
+		
+		rep = [f'Transitions object representing [{self._value}]']
+		rep.append('{')
+		for k, v in self._sources.items():
+			fmt_size = max(len(str(x)) for x in v) + 2 # Account for quotes around the word
+			rep.append(f'\t{k}:')
+			for letter, count in v.items():
+			
+				rep.append('\t\t{} : {}'.format(
+					('{:>' + str(fmt_size) + '}').format('"' + str(letter) + '"'),
+					count))
+		
+		rep.append('}')
+	
+		return '\n'.join(rep)
+
+
+# -------------------------------------------------------------------------------------------------
+# MarkovChainHandler
+# -------------------------------------------------------------------------------------------------
+class MarkovChainHandler(object):
+
+	def __init__(self, params, rng=None):
+
+		'''
+		`rng` is the random.Random instance names are generated with when GenerateChain isn't given one.
+		By default it's seeded with `params.seed` if there is one, so runs can be reproduced.
+		'''
+
+		self._connections = { None : Transitions(None) }
+		self._args      = params
+		self._start     = LRUCache(STARTING_TERMS_CACHE_SIZE)
+		self._startLock = threading.Lock()
+		self._random    = rng if rng is not None else random.Random(getattr(params, 'seed', None))
+		self._lock      = threading.Lock()
+		self._prepared = False
+		self._logProbs = {}
+		self._sampling = LRUCache(SAMPLING_CACHE_SIZE)
+
+
+	def Debug(self):
+		''' Show the size and shape of the chain (see Analyze). '''
+		print(json.dumps(self.Analyze(), indent='\t'))
+
+	def Analyze(self, top=5):
+
+		'''
+		Returns CompiledTables.Analyze for the chain, along with the estimated memory of the transition counts and
+		the sampling tables built so far that a trained chain holds in dictionaries until it's compiled.
+		'''
+
+		report   = self.Compile().Analyze(top)
+		measured = self._Measure()
+		built    = sum(len(table) for x in self._connections.values() for table in x._transitionCache.values())
+
+		report['memory_bytes']['transition_counts'] = measured['edges'] * TABLE_ENTRY_BYTES
+		report['memory_bytes']['sampling_tables']   = built * TABLE_ENTRY_BYTES
+		report['memory_bytes']['total']             = sum(v for k, v in report['memory_bytes'].items() if k != 'total')
+
+		return report
+			
+	def _Terms(self):
+		'''Returns every term in the chain (including None).  Subclasses storing transitions differently override this.'''
+		return self._connections
+
+	def _PickTerm(self, term, direction, noNones, rng):
+		'''Randomly pick a term connected to `term`.  Subclasses storing transitions differently override this.'''
+		return self._connections[term].PickRandomTerm(direction, noNones, rng)
+
+	def _Counts(self, term, direction):
+		'''
+		Returns (term, count) pairs for the transitions out of `term`, or nothing if the term isn't in the chain.
+		Subclasses storing transitions differently override this.
+		'''
+		transitions = self._connections.get(term)
+		return list(transitions._sources[direction].items()) if transitions else []
+
+	def _SamplingTable(self, term, direction, noNones, temperature, topP):
+
+		'''
+		Returns the terms `term` can transition to, most likely first, along with the running total of their weights
+		after sharpening (temperature < 1) or flattening (temperature > 1) the counts and keeping only the most likely
+		terms making up `topP` of the total.  Tables are built the first time they're needed and cached.
+		'''
+
+		key = (term, direction, noNones, temperature, topP)
+
+		with self._lock:
+			table = self._sampling.Get(key)
+
+		if table is None:
+
+			STATS.Count('cache.sampling_tables')
+
+			counts = [(t, c) for t, c in self._Counts(term, direction) if c > 0 and not (noNones and t is None)]
+			table  = ([], [])
+
+			if counts:
+
+				# Scale by the largest count first so large counts can't overflow when raised to a large power.
+				largest = max(c for _, c in counts)
+				weights = sorted(((t, (c / largest) ** (1 / temperature)) for t, c in counts), key=lambda x: -x[1])
+
+				total   = sum(w for _, w in weights)
+				kept    = 0
+				running = 0.0
+
+				while kept < len(weights) and running < topP * total:
+					running += weights[kept][1]
+					kept    += 1
+
+				table = ([t for t, _ in weights[:kept]], list(accumulate(w for _, w in weights[:kept])))
+
+			with self._lock:
+				self._sampling.Put(key, table)
+
+		return table
+
+	def _PickTuned(self, term, direction, noNones, rng, temperature, topP):
+		'''Same as _PickTerm, after reshaping the probabilities of the transitions (see _SamplingTable).'''
+
+		targets, cumulative = self._SamplingTable(term, direction, noNones, temperature, topP)
+		if not targets:
+			return None
+
+		return targets[bisect.bisect_right(cumulative, rng.random() * cumulative[-1])]
+
+	def _Invalidate(self):
+		'''Note that the chain changed, so sampling tables and starting terms need to be prepared again.'''
+		self._start    = LRUCache(STARTING_TERMS_CACHE_SIZE)
+		self._prepared = False
+		self._logProbs = {}
+		self._sampling = LRUCache(SAMPLING_CACHE_SIZE)
+
+	def Prepare(self):
+
+		'''
+		Build the sampling tables the chain's own `direction` and `minlen` generate from, and the list of starting
+		terms, up front.  GenerateChain does this (under a lock) the first time it runs after the chain changes.
+		Tables only other params sample from are built the first time they're needed, which is safe while other
+		threads are generating, but training the chain while it's generating names is not thread-safe.
+		'''
+
+		with self._lock, Span('prepare'):
+
+			if self._prepared:
+				return
+
+			STATS.Count('cache.prepares')
+
+			# Names always start with a term picked from what follows None, and noNones tables are only used
+			# while a name has fewer than minlen terms.
+			directions = SAMPLED_TABLES[self._args.direction]
+			noNones    = (False, True) if self._args.minlen > 1 else (False,)
+
+			self._connections[None]._GenerateCache('to', True)
+
+			for term, transitions in self._connections.items():
+				if term is not None:
+					for direction in directions:
+						for exclude in noNones:
+							transitions._GenerateCache(direction, exclude)
+
+			self._StartingTerms(self._args.start, verbose=True)
+			self._prepared = True
+
+	def Compile(self, directions=None):
+		'''Flatten the chain's transitions into CompiledTables, in just the given `directions` ('to' and 'from') if asked to.'''
+		return CompiledTables(self._connections, directions or CompiledTables.DIRECTIONS)
+
+	def Params(self):
+		'''Returns the arguments the chain was constructed with.'''
+		return self._args
+
+	def Score(self, termstrings, direction='forward'):
+
+		'''
+		Returns the log-probability (natural log) of the chain generating each sequence of terms in `termstrings`,
+		reading them start to end ('forward') or end to start ('backward').  Sequences the chain could never
+		generate score -inf.
+
+		Every transition of every sequence is looked up in one pass over a table of log-probabilities, which is
+		built the first time a direction is scored and kept until the chain changes.
+		'''
+
+		if direction not in ('forward', 'backward'):
+			raise ValueError(f'Cannot score names in the direction "{direction}"')
+
+		table = self._logProbs.get(direction)
+		if table is None:
+			STATS.Count('cache.log_probability_tables')
+			tables = { 'forward' : 'to', 'backward' : 'from' }[direction]
+			table  = self._logProbs[direction] = self.Compile((tables,)).LogProbabilities(tables)
+
+		pairs = []
+		ends  = []
+
+		for terms in termstrings:
+
+			terms = [None] + [x.lower() for x in terms if x] + [None]
+			if direction == 'backward':
+				terms.reverse()
+
+			pairs.extend(zip(terms[:-1], terms[1:]))
+			ends.append(len(pairs))
+
+		logs = list(map(table.get, pairs, repeat(-math.inf)))
+
+		return [sum(logs[begin:end]) for begin, end in zip([0] + ends[:-1], ends)]
+
+	def _StartingTerms(self, start, verbose=False):
+		'''
+		Rather than continuously try to find a valid starting term, pre-populate a list with valid terms
+		so we can simply draw from it during each name generation.  Lists are cached for the most recently used sets
+		of `start` prefixes (see STARTING_TERMS_CACHE_SIZE).
+		'''
+		
+		if not start:
+			return None
+
+		# Don't bother trying to recalculate this if we previously have done so.
+		key = tuple(x.lower() for x in start)
+
+		with self._startLock:
+			collection = self._start.Get(key)
+
+		if collection is not None:
+			return collection
+
+		STATS.Count('cache.starting_terms')
+
+		collection = []
+		for prefix in key:
+			collection.extend([x for x in self._Terms() if x and x.startswith(prefix)])
+
+		if not collection:
+			
+			# Show what terms we actually have populated.  If inputs to this change (for instance,
+			# random splitting of input terms), then the output here probably won't make as much
+			# sense.
+				
+			tmp = defaultdict(list)
+			for elem in map(str, self._Terms()):
+				tmp[elem[0]].append(elem)
+					
+			for k in sorted(tmp):
+				if verbose: print(sorted(tmp[k]))
+				
+			raise ValueError(f'None of the starting terms ({start}) exist as elements in the Markov Chain handler!')
+				
+		with self._startLock:
+			self._start.Put(key, collection)
+
+		return collection
+		
+
+	def UpdateTermString(self, terms):
+
+		''' Given an iterable sequence of terms, bidirectionally connect elements with their neighbors. '''
+
+		# Ensure all terms exist. ---------------------------------------------
+
+		terms = [x.lower() for x in terms]
+		
+		for term in terms:
+			if term not in self._connections:
+				self._connections[term] = Transitions(term)
+
+		# Connect neighboring terms with each other. --------------------------
+
+		for thisTerm, nextTerm in zip(terms[:-1], terms[1:]):
+
+			self._connections[thisTerm].ConnectWith(nextTerm, 'to')
+			self._connections[nextTerm].ConnectWith(thisTerm, 'from')
+
+		# Connect the starting and ending term with 'none.' -------------------
+
+		self._connections[None].ConnectWith(terms[0], 'to')
+		self._connections[terms[0]].ConnectWith(None, 'from')
+
+		self._connections[terms[-1]].ConnectWith(None, 'to')
+		self._connections[None].ConnectWith(terms[-1], 'from')
+		
+		# Cache starting terms based on input arguments -----------------------
+
+		self._Invalidate()
+
+	def UpdateTransitionCounts(self, counts):
+
+		'''
+		Merge a table of transition counts (see CountTransitions) into the chain.  Merging the tables counted
+		for any split of the training data gives the same chain as calling UpdateTermString on all of it.
+		'''
+
+		for (thisTerm, nextTerm), count in counts.items():
+
+			for term in (thisTerm, nextTerm):
+				if term not in self._connections:
+					self._connections[term] = Transitions(term)
+
+			self._connections[thisTerm].ConnectWith(nextTerm, 'to', count)
+			self._connections[nextTerm].ConnectWith(thisTerm, 'from', count)
+
+		self._Invalidate()
+
+	def _Measure(self):
+
+		'''
+		Summarize the size of the chain and the entropy (in bits) of its forward transitions, averaged over
+		states by how often each state is left.  The sampling tables hold one entry per counted transition.
+		'''
+
+		edges = entries = 0
+		entropy = 0.0
+
+		for transitions in self._connections.values():
+
+			for direction, counts in transitions._sources.items():
+				edges   += len(counts)
+				entries += sum(counts.values())
+
+			total = sum(transitions._sources['to'].values())
+			for count in transitions._sources['to'].values():
+				entropy -= count * math.log2(count / total)
+
+		leaving = sum(sum(x._sources['to'].values()) for x in self._connections.values())
+
+		return {
+			'states'         : len(self._connections) - 1,
+			'edges'          : edges,
+			'table_entries'  : entries,
+			'estimated_bytes': (edges + entries) * TABLE_ENTRY_BYTES,
+			'entropy'        : entropy / leaving if leaving else 0.0,
+		}
+
+	def Compact(self, minCount=1, minProbability=0.0, minStateCount=1, bits=8):
+
+		'''
+		Shrink a trained chain, trading a little fidelity for memory and load time.
+
+			1) Terms seen fewer than `minStateCount` times are removed, along with every transition to or from them.
+			2) Transitions counted fewer than `minCount` times, or making up less than `minProbability` of the
+			   transitions in their direction from a term, are dropped.
+			3) The remaining counts of each term are rescaled to fit in `bits`-bit integers (never below 1),
+			   which bounds the size of the sampling tables built from them.
+
+		Returns a report of the size and entropy of the chain before and after compaction.
+		'''
+
+		before  = self._Measure()
+		largest = (1 << bits) - 1
+
+		removed = {
+			term for term, transitions in self._connections.items()
+			if term is not None and sum(transitions._sources['from'].values()) < minStateCount
+		}
+
+		for term in removed:
+			del self._connections[term]
+
+		for transitions in self._connections.values():
+			for direction, counts in transitions._sources.items():
+
+				total = sum(counts.values())
+				kept  = {
+					term : count for term, count in counts.items()
+					if term not in removed and count >= minCount and count >= minProbability * total
+				}
+
+				scale = min(1.0, largest / max(kept.values())) if kept else 1.0
+
+				counts.clear()
+				counts.update((term, max(1, int(round(count * scale)))) for term, count in kept.items())
+
+			transitions._transitionCache = {}
+
+		self._Invalidate()
+
+		after = self._Measure()
+
+		return {
+			'before'        : before,
+			'after'         : after,
+			'entropy_change': after['entropy'] - before['entropy'],
+		}
+
+	def GenerateChain(self, rng=None, params=None):
+
+		'''
+		Generates a sequence of elements based on input arguments specified in the constructor, or the
+		`params` (minlen, maxlen, direction and start) given for just this call.
+
+		If the params also have a `temperature` other than 1 or a `top_p` below 1, each term is picked after
+		raising the transition counts to the power 1/temperature and keeping only the most likely terms that make
+		up `top_p` of the (reshaped) probability.
+		Random choices are made with `rng`, or the chain's own random.Random instance if it isn't given.
+		Any number of threads can generate at once, as long as each passes its own `rng`.
+
+		Returns either `None` or a sequence of elements
+		'''
+
+		with Span('sample'):
+			return self._GenerateChain(rng, params)
+
+	def _GenerateChain(self, rng, params):
+
+		rng   = self._random if rng is None else rng
+		args  = self._args   if params is None else params
+		chain = deque()
+
+		temperature = getattr(args, 'temperature', None) or 1.0
+		top_p       = getattr(args, 'top_p',       None) or 1.0
+		pick        = self._PickTerm
+
+		if temperature <= 0 or not 0 < top_p <= 1:
+			raise ValueError('The temperature must be positive, and top_p between 0 (exclusive) and 1')
+
+		if temperature != 1.0 or top_p < 1.0:
+			pick = lambda term, direction, noNones, rng: self._PickTuned(term, direction, noNones, rng, temperature, top_p)
+
+		if not self._prepared:
+			self.Prepare()
+
+		STATS.Count('generate.attempts')
+
+		# By default, start using "None" to force generations to start with terms
+		# explicitly used in the input. This can be overridden by the args constructed
+		# with this class.
+
+		starting_term = None
+		start         = self._StartingTerms(args.start)
+		if start:		
+			starting_term = rng.choice(start)
+			chain.append((starting_term))
+
+		else:
+			chain.append(pick(starting_term, 'to', True, rng))
+
+		if chain[0] is None:
+			STATS.Count('generate.rejected.no_start')
+			return None
+
+		# -----------------------------------------------------------------------------
+		# Generate the name until we think it's good.
+		# -----------------------------------------------------------------------------
+
+		while 1:
+
+			stringified = ''.join(x for x in chain if x)
+			if len(stringified) >= args.maxlen:
+				break
+
+			allowed_directions = []
+			if chain[0]  is not None and args.direction != 'forward':  allowed_directions.append('backward')
+			if chain[-1] is not None and args.direction != 'backward': allowed_directions.append('forward')
+
+			if not allowed_directions:
+
+				STATS.Count('generate.steps', len(chain))
+
+				if len(stringified) < args.minlen:
+					STATS.Count('generate.rejected.too_short')
+					return None
+
+				STATS.Count('generate.completed')
+				return stringified
+
+			temp_direction = rng.choice(allowed_directions)
+
+			if temp_direction == 'forward':
+				nextTerm = pick(chain[-1], 'to', len(chain) < args.minlen, rng)
+				chain.append(nextTerm)
+			else:
+				nextTerm = pick(chain[0], 'from', len(chain) < args.minlen, rng)
+				chain.appendleft(nextTerm)
+
+		STATS.Count('generate.steps', len(chain))
+		STATS.Count('generate.maxlen')
+
+		return tuple(x for x in chain if x)
+
+	def YieldMostProbable(self, width=10000, params=None):
+
+		'''
+		Deterministically yield (log-probability, name) pairs in descending order of how likely GenerateChain is to
+		generate them, following the same rules for `minlen`, `maxlen`, `start` and `direction` (taken from `params`
+		like GenerateChain does).  Names reached in more than one way (common when generating 'bidirectional'ly) are
+		only yielded once, ranked by their most probable way of being generated.
+
+		This is a best-first search: partial names are expanded most probable first, so a finished name is only
+		yielded once nothing left could beat it.  At most 2 * `width` partial names are kept, with the least probable
+		ones dropped past that, so the order is exact until the first partial names are dropped.
+		'''
+
+		args   = self._args if params is None else params
+		tables = self.Compile(SAMPLED_TABLES[args.direction])
+		vocab  = tables.vocabulary
+		rows   = {}
+
+		def Successors(term, direction, noNones):
+
+			key = (term, direction, noNones)
+			if key not in rows:
+
+				counts = tables.Row(term, direction)
+				if noNones:
+					counts = [x for x in counts if x[0] != 0]
+
+				total     = sum(x[1] for x in counts)
+				rows[key] = [(t, math.log(c / total)) for t, c in counts] if total else [(0, 0.0)]
+
+			return rows[key]
+
+		# Each entry is (-log-probability, tiebreaker, terms) with terms numbered as in `tables`, 0 being None.
+		heap    = []
+		counter = 0
+
+		start = self._StartingTerms(args.start)
+		if start:
+			for term in start:
+				heap.append((math.log(len(start)), counter, (tables.Index(term),)))
+				counter += 1
+		else:
+			for term, logp in Successors(0, 'to', True):
+				if term:
+					heap.append((-logp, counter, (term,)))
+					counter += 1
+
+		heapq.heapify(heap)
+		emitted = set()
+
+		while heap:
+
+			cost, _, chain = heapq.heappop(heap)
+			length         = sum(len(vocab[x]) for x in chain if x)
+
+			allowed = []
+			if length < args.maxlen:
+				if chain[0]  and args.direction != 'forward':  allowed.append('from')
+				if chain[-1] and args.direction != 'backward': allowed.append('to')
+
+			if not allowed:
+
+				name = ''.join(vocab[x] for x in chain if x)
+				if (length >= args.maxlen or length >= args.minlen) and name not in emitted:
+					emitted.add(name)
+					yield -cost, name
+
+				continue
+
+			noNones = len(chain) < args.minlen
+			split   = math.log(len(allowed))
+
+			for direction in allowed:
+				for term, logp in Successors(chain[-1] if direction == 'to' else chain[0], direction, noNones):
+
+					extended = chain + (term,) if direction == 'to' else (term,) + chain
+					heapq.heappush(heap, (cost + split - logp, counter, extended))
+					counter += 1
+
+			if len(heap) > 2 * width:
+				heap = heapq.nsmallest(width, heap)
+
+
+
+# -------------------------------------------------------------------------------------------------
+# CompiledTables
+# -------------------------------------------------------------------------------------------------
+def Distribution(values):
+	'''Summarize a list of numbers by their minimum, mean, a few percentiles and maximum.'''
+
+	if not values:
+		return { 'min' : 0, 'mean' : 0, 'p50' : 0, 'p90' : 0, 'p99' : 0, 'max' : 0 }
+
+	values = sorted(values)
+	pick   = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+
+	return {
+		'min'  : values[0],
+		'mean' : sum(values) / len(values),
+		'p50'  : pick(0.50),
+		'p90'  : pick(0.90),
+		'p99'  : pick(0.99),
+		'max'  : values[-1],
+	}
+
+
+def BucketLabel(value):
+	'''Label the power of two bucket a count falls into: '0', '1', '2', '3-4', '5-8', '9-16' and so on.'''
+
+	if value <= 2:
+		return str(value)
+
+	upper = 1 << (value - 1).bit_length()
+	return f'{upper // 2 + 1}-{upper}'
+
+
+# The tables ('to' follows a term, 'from' precedes it) generating in each direction samples from.  Names always
+# start with a term picked from what follows None, so that one row of the 'to' table is needed whatever the
+# direction (and is always compiled, see CompiledTables).
+SAMPLED_TABLES = {
+	'forward'       : ('to',),
+	'backward'      : ('from',),
+	'bidirectional' : ('to', 'from'),
+}
+
+class CompiledTables(object):
+
+	'''
+	A chain's transitions flattened into a few integer arrays, in the style of a sparse (CSR) matrix.
+
+	Terms are numbered by their position in `vocabulary`, with None always being 0.  For each direction ('to'
+	and 'from'), the transitions out of term `i` are stored in `targets[offsets[i]:offsets[i+1]]`, alongside a
+	running total of their counts in `cumulative`.  A transition to None is always stored first in its row,
+	so excluding it (the "noNones" case) is a matter of starting one slot later.
+
+	Tables can be compiled for only some of the directions (see SAMPLED_TABLES), using them in another raises
+	ValueError.  The row of terms following None (which names start with) is compiled regardless, as a 'to'
+	table of that single row.  The arrays can be backed by any buffer -- including shared memory -- without copying.
+	'''
+
+	DIRECTIONS = ('to', 'from')
+
+	def __init__(self, connections=None, directions=DIRECTIONS):
+
+		self.vocabulary = [None]
+		self.tables     = {}
+		self.training   = {}   # How names were split apart (method and split) to train the chain, if recorded.
+
+		if connections is None:
+			return
+
+		STATS.Count('cache.compiles')
+
+		self.vocabulary += sorted(x for x in connections if x is not None)
+		index = { term : i for i, term in enumerate(self.vocabulary) }
+
+		unknown = set(directions) - set(self.DIRECTIONS)
+		if unknown:
+			raise ValueError(f'Cannot compile transitions in the direction(s) {sorted(unknown)}')
+
+		for direction in self.DIRECTIONS:
+
+			if direction in directions:
+				terms = self.vocabulary
+			elif direction == 'to':
+				terms = self.vocabulary[:1]
+			else:
+				continue
+
+			offsets, targets, cumulative = array('q', [0]), array('q'), array('q')
+
+			for term in terms:
+
+				counts = connections[term]._sources[direction]
+				total  = 0
+
+				for target in sorted(counts, key=lambda x: x is not None):
+					total += counts[target]
+					targets.append(index[target])
+					cumulative.append(total)
+
+				offsets.append(len(targets))
+
+			self.tables[direction] = (offsets, targets, cumulative)
+
+		self._index = index
+
+	def Index(self, term):
+		'''Returns the number of a term in the vocabulary, or None if it isn't in the chain.'''
+		return self._index.get(term)
+
+	def Has(self, direction):
+		'''Whether every term's transitions in `direction` were compiled (rather than none, or only None's).'''
+		return direction in self.tables and len(self.tables[direction][0]) == len(self.vocabulary) + 1
+
+	def _Table(self, direction, term):
+		'''Returns the (offsets, targets, cumulative) arrays for a direction, if they hold the row for `term`.  Raises ValueError.'''
+
+		tables = self.tables.get(direction)
+		if tables is None or term + 1 >= len(tables[0]):
+			raise ValueError(f'The chain was compiled without its "{direction}" transitions')
+
+		return tables
+
+	def Row(self, term, direction):
+		'''Returns (term number, count) pairs for the transitions out of the term numbered `term`.'''
+
+		offsets, targets, cumulative = self._Table(direction, term)
+		start, end = offsets[term], offsets[term+1]
+
+		return [(targets[j], cumulative[j] - (cumulative[j-1] if j > start else 0)) for j in range(start, end)]
+
+	def Analyze(self, top=5):
+
+		'''
+		Summarize the size and shape of the chain for sizing and tuning it:
+
+			states       : Number of terms (not counting None).
+			directions   : For 'to' (what follows a term) and 'from' (what precedes it):
+			               edges, the branching factor of the terms (as a distribution, and a histogram bucketed by
+			               powers of two), and the entropy in bits of each term's transitions (as a distribution, the
+			               mean weighted by how often each term is left, and the `top` least predictable terms).
+			boundaries   : How many terms start and end names, and the probability of a term being followed by the
+			               end of the name (or preceded by its start).
+			memory_bytes : Bytes used by each of the arrays and the vocabulary.
+		'''
+
+		report = { 'states' : len(self.vocabulary) - 1, 'directions' : {}, 'boundaries' : {}, 'memory_bytes' : {} }
+
+		for direction in filter(self.Has, self.DIRECTIONS):
+
+			degrees    = []
+			entropies  = []
+			histogram  = Counter()
+			weighted   = 0.0
+			transitions = boundary = boundaryTerms = 0
+
+			for term in range(1, len(self.vocabulary)):
+
+				row   = self.Row(term, direction)
+				total = sum(c for _, c in row)
+
+				degrees.append(len(row))
+				histogram[BucketLabel(len(row))] += 1
+
+				if not total:
+					continue
+
+				entropy = 0.0 - sum(c / total * math.log2(c / total) for _, c in row)
+				entropies.append((entropy, self.vocabulary[term]))
+
+				weighted      += entropy * total
+				transitions   += total
+				boundary      += sum(c for t, c in row if t == 0)
+				boundaryTerms += any(t == 0 for t, _ in row)
+
+			report['directions'][direction] = {
+				'edges'       : len(self.tables[direction][1]),
+				'transitions' : transitions,
+				'branching'   : dict(Distribution(degrees), histogram=dict(sorted(histogram.items(), key=lambda x: int(x[0].split('-')[0])))),
+				'entropy'     : dict(
+					Distribution([x for x, _ in entropies]),
+					weighted_mean = weighted / transitions if transitions else 0.0,
+					highest       = [{ 'term' : term, 'bits' : bits } for bits, term in heapq.nlargest(top, entropies)],
+				),
+			}
+
+			kind = { 'to' : 'end', 'from' : 'start' }[direction]
+
+			report['boundaries'][f'{kind}_probability'] = boundary / transitions if transitions else 0.0
+			report['boundaries'][f'{kind}_terms']       = boundaryTerms
+
+		for direction, tables in self.tables.items():
+			for name, values in zip(('offsets', 'targets', 'cumulative'), tables):
+				report['memory_bytes'][f'{direction}.{name}'] = values.itemsize * len(values)
+
+		report['memory_bytes']['vocabulary'] = sys.getsizeof(self.vocabulary) + sum(sys.getsizeof(x) for x in self.vocabulary)
+		report['memory_bytes']['index']      = sys.getsizeof(getattr(self, '_index', {}))
+		report['memory_bytes']['total']      = sum(report['memory_bytes'].values())
+
+		return report
+
+	def LogProbabilities(self, direction):
+
+		'''
+		Returns the natural log of the probability of every transition in `direction`, keyed by the pair of terms
+		(not term numbers) it connects.
+		'''
+
+		offsets, targets, cumulative = self._Table(direction, len(self.vocabulary) - 1)
+
+		table = {}
+
+		for i, term in enumerate(self.vocabulary):
+
+			start, end = offsets[i], offsets[i+1]
+			if start == end:
+				continue
+
+			total    = math.log(cumulative[end-1])
+			previous = 0
+
+			for j in range(start, end):
+				table[term, self.vocabulary[targets[j]]] = math.log(cumulative[j] - previous) - total
+				previous = cumulative[j]
+
+		return table
+
+	def PickRandomTerm(self, term, direction, noNones=False, rng=random):
+
+		'''Same as Transitions.PickRandomTerm, for the term numbered `term`.  Returns a term number (0 for None), or None.'''
+
+		offsets, targets, cumulative = self._Table(direction, term)
+
+		start, end = offsets[term], offsets[term+1]
+		if start == end:
+			return None
+
+		base = 0
+		if noNones and targets[start] == 0:
+			base   = cumulative[start]
+			start += 1
+
+		total = cumulative[end-1] - base
+		if total <= 0:
+			return None
+
+		return targets[bisect.bisect_right(cumulative, base + rng.randrange(total), start, end)]
+
+	# ---------------------------------------------------------------------------------------------
+	# Serialization: an 8 byte header length, a JSON header, then each array as 64-bit integers.
+	# ---------------------------------------------------------------------------------------------
+
+	def _Header(self):
+		return json.dumps({
+			'vocabulary' : self.vocabulary,
+			'training'   : self.training,
+			'sizes'      : { direction : [len(x) for x in tables] for direction, tables in self.tables.items() },
+		}).encode()
+
+	def ByteSize(self):
+		'''Returns how large a buffer WriteInto needs.'''
+		header = len(self._Header())
+		return 8 + header + (-header % 8) + 8 * sum(sum(len(x) for x in tables) for tables in self.tables.values())
+
+	def WriteInto(self, buffer):
+
+		'''Serialize the tables into a writable buffer of at least ByteSize() bytes.'''
+
+		header = self._Header()
+		buffer[:8] = len(header).to_bytes(8, 'little')
+		buffer[8:8+len(header)] = header
+
+		position = 8 + len(header) + (-len(header) % 8)
+		for tables in self.tables.values():
+			for table in tables:
+				data = table.tobytes()
+				buffer[position:position+len(data)] = data
+				position += len(data)
+
+	@classmethod
+	def FromBuffer(cls, buffer):
+
+		'''Load tables serialized with WriteInto.  The arrays are read-only views into `buffer`, not copies.'''
+
+		buffer = memoryview(buffer)
+		length = int.from_bytes(buffer[:8], 'little')
+		header = json.loads(bytes(buffer[8:8+length]))
+
+		compiled = cls()
+		compiled.vocabulary = header['vocabulary']
+		compiled.training   = header.get('training', {})
+		compiled._index     = { term : i for i, term in enumerate(compiled.vocabulary) }
+
+		position = 8 + length + (-length % 8)
+		for direction, sizes in header['sizes'].items():
+
+			tables = []
+			for size in sizes:
+				tables.append(buffer[position:position + 8*size].toreadonly().cast('q'))
+				position += 8*size
+
+			compiled.tables[direction] = tuple(tables)
+
+		return compiled
+
+	def Release(self):
+		'''Release views into the buffer the tables were loaded from, so it can be closed.'''
+
+		for tables in self.tables.values():
+			for table in tables:
+				if isinstance(table, memoryview):
+					table.release()
+
+		self.tables = {}
+
+# -------------------------------------------------------------------------------------------------
+# SharedChainHandler
+# -------------------------------------------------------------------------------------------------
+
+# Where published chains live.  On Linux this is memory backed, so attaching never touches a disk.
+SHARED_CHAIN_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+class SharedChainHandler(MarkovChainHandler):
+
+	'''
+	Generates names from a chain published into shared memory by another process, so any number of worker
+	processes can sample from one copy of the model.  The chain is read-only.
+
+		owner  = SharedChainHandler.Publish(chain, 'elvish')      # In the process that trained the chain
+		worker = SharedChainHandler(params, 'elvish')             # In each worker process
+		worker.GenerateChain()
+		...
+		owner.Unlink()                                             # Once every worker is done
+
+	Chains are published as a memory mapped file in SHARED_CHAIN_DIRECTORY rather than through
+	multiprocessing.shared_memory, whose resource tracker destroys the memory when the first unrelated
+	process attached to it exits.
+	'''
+
+	def __init__(self, params, name):
+
+		MarkovChainHandler.__init__(self, params)
+
+		self._path = self.PathFor(name)
+
+		try:
+			with open(self._path, 'rb') as f:
+				self._memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		except FileNotFoundError:
+			raise ValueError(f'There is no chain shared as "{name}"') from None
+
+		self._tables = CompiledTables.FromBuffer(self._memory)
+
+		direction = getattr(params, 'direction', None)
+		missing   = [x for x in SAMPLED_TABLES.get(direction, ()) if not self._tables.Has(x)]
+
+		if missing:
+			self.Close()
+			raise ValueError(f'The shared chain "{name}" was published without the "{missing[0]}" transitions generating {direction} needs.  Share it with --direction {direction}.')
+
+	@staticmethod
+	def PathFor(name):
+		'''Returns the file a chain published under `name` is mapped from.'''
+		return os.path.join(SHARED_CHAIN_DIRECTORY, f'namegen-{name}.chain')
+
+	@classmethod
+	def Publish(cls, chain, name=None, directions=None):
+		'''
+		Compile `chain` (in just the given `directions`, if asked to) into shared memory under `name` (or a random
+		name), returning a handler attached to it.
+		'''
+
+		name     = name or os.urandom(8).hex()
+		compiled = chain.Compile(directions)
+
+		compiled.training = { x : getattr(chain.Params(), x, None) for x in ('method', 'split') }
+		path     = cls.PathFor(name)
+
+		# Build the file under a temporary name so workers never attach to a half-written chain.
+		with open(path + '.tmp', 'w+b') as f:
+			f.truncate(compiled.ByteSize())
+			with mmap.mmap(f.fileno(), 0) as memory:
+				compiled.WriteInto(memory)
+
+		os.replace(path + '.tmp', path)
+
+		return cls(chain._args, name)
+
+	def Name(self):
+		'''Returns the name workers attach to.'''
+		return os.path.basename(self._path)[len('namegen-'):-len('.chain')]
+
+	def Params(self):
+		'''
+		Returns the arguments the chain was attached with, except for the method and split the publisher trained it
+		with (None if the chain doesn't record them).
+		'''
+
+		params = copy.copy(self._args)
+		params.__dict__.update({ 'method' : None, 'split' : None, **self._tables.training })
+
+		return params
+
+	def _Terms(self):
+		return self._tables.vocabulary
+
+	def _Counts(self, term, direction):
+		index = self._tables.Index(term)
+		if index is None:
+			return []
+		vocabulary = self._tables.vocabulary
+		return [(vocabulary[t], c) for t, c in self._tables.Row(index, direction)]
+
+	def _PickTerm(self, term, direction, noNones, rng):
+		picked = self._tables.PickRandomTerm(self._tables.Index(term), direction, noNones, rng)
+		return None if picked is None else self._tables.vocabulary[picked]
+
+	def UpdateTermString(self, terms):
+		raise TypeError('Shared chains are read-only!')
+
+	def UpdateTransitionCounts(self, counts):
+		raise TypeError('Shared chains are read-only!')
+
+	def Compact(self, minCount=1, minProbability=0.0, minStateCount=1, bits=8):
+		raise TypeError('Shared chains are read-only!')
+
+	def Compile(self, directions=None):
+		return self._tables
+
+	def Close(self):
+		'''Detach from the shared memory.'''
+		self._tables.Release()
+		self._memory.close()
+
+	def Unlink(self):
+		'''Detach from and remove the published chain.  Workers already attached keep working until they close.'''
+		self.Close()
+		os.remove(self._path)
+
+
+# -------------------------------------------------------------------------------------------------
+# MixtureChainHandler
+# -------------------------------------------------------------------------------------------------
+
+# How many blends (sets of weights) a mixture keeps sampling tables around for.
+MIXTURE_BLEND_CACHE_SIZE = 16
+
+class MixtureChainHandler(MarkovChainHandler):
+
+	'''
+	Generates names from a weighted mixture of several trained chains, without retraining or merging them.
+
+		mixture = MixtureChainHandler(params, { 'elvish' : elvish, 'nordic' : nordic }, { 'elvish' : 3, 'nordic' : 1 })
+		mixture.GenerateChain()
+
+	The next term is picked from the chains' transition probabilities (not their raw counts, so a large corpus
+	doesn't drown out a small one) averaged by weight.  The averaged table for a term is only built the first
+	time the term is visited, and then cached.  `params` may carry `weights` to pick a different blend for a
+	single GenerateChain call; the tables of the most recently used blends are kept.  The mixture is read-only.
+	'''
+
+	def __init__(self, params, models, weights=None, rng=None, _shared=None):
+
+		MarkovChainHandler.__init__(self, params, rng)
+
+		self._models  = dict(models)
+		self._weights = self._Normalize(weights)
+
+		if _shared is None:
+
+			# Sorted (None first) rather than a set, so starting terms are drawn in the same order on every run.
+			vocabulary = set().union(*(model._Terms() for model in self._models.values()))
+			vocabulary = tuple(sorted(vocabulary, key=lambda x: (x is not None, x or '')))
+
+			_shared = (vocabulary, LRUCache(MIXTURE_BLEND_CACHE_SIZE), threading.Lock())
+
+		self._shared = _shared
+
+	def _Normalize(self, weights):
+		'''Returns `weights` (every model weighted the same by default) as a tuple of (model name, weight) pairs.'''
+
+		weights = weights or dict.fromkeys(self._models, 1)
+
+		unknown = set(weights) - set(self._models)
+		if unknown:
+			raise ValueError(f'No models named {sorted(unknown)} to mix.  Models: {sorted(self._models)}')
+
+		if any(x < 0 for x in weights.values()) or not any(x > 0 for x in weights.values()):
+			raise ValueError('Mixture weights must not be negative, and at least one must be positive')
+
+		return tuple(sorted((name, float(weight)) for name, weight in weights.items() if weight > 0))
+
+	def Blend(self, weights):
+		'''Returns the mixture of the same chains with different `weights`, sharing any tables already built for them.'''
+
+		key = self._Normalize(weights)
+		if key == self._weights:
+			return self
+
+		vocabulary, blends, lock = self._shared
+
+		with lock:
+			blend = blends.Get(key)
+			if blend is None:
+				blend = MixtureChainHandler(self._args, self._models, dict(key), self._random, self._shared)
+				blends.Put(key, blend)
+
+		return blend
+
+	def Models(self):
+		'''Returns the mixed chains by name.'''
+		return dict(self._models)
+
+	def _Terms(self):
+		return self._shared[0]
+
+	def _Counts(self, term, direction):
+
+		merged = defaultdict(float)
+
+		for name, weight in self._weights:
+
+			counts = self._models[name]._Counts(term, direction)
+			total  = sum(c for _, c in counts)
+
+			for t, c in counts:
+				merged[t] += weight * c / total
+
+		return list(merged.items())
+
+	def _PickTerm(self, term, direction, noNones, rng):
+		return self._PickTuned(term, direction, noNones, rng, 1.0, 1.0)
+
+	def GenerateChain(self, rng=None, params=None):
+
+		weights = getattr(params, 'weights', None)
+		if weights:
+			return MarkovChainHandler.GenerateChain(self.Blend(weights), rng, params)
+
+		return MarkovChainHandler.GenerateChain(self, rng, params)
+
+	def UpdateTermString(self, terms):
+		raise TypeError('Mixtures of chains are read-only!')
+
+	def UpdateTransitionCounts(self, counts):
+		raise TypeError('Mixtures of chains are read-only!')
 
+	def Compile(self, directions=None):
+		raise TypeError('Mixtures of chains are blended while sampling, and can\'t be compiled!')